@@ -0,0 +1,155 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import reccomendation_algorithim as recommender
+from ranking import top_k_rows
+
+# Recommendations for many users at once. Users are scored a block at a time
+# as one users x movies score matrix (sparse products against the whole
+# ratings matrix instead of one user's rows at a time), then each row is
+# ranked exactly like the single-user engines rank it.
+
+
+def _block_ratings(ratings, userIdxs):
+    # sparse len(userIdxs) x movies matrix of the users' centered ratings
+    rows = [ratings.user_row(userIdx) for userIdx in userIdxs]
+    indptr = np.concatenate([[0], np.cumsum([len(cols) for cols, _ in rows])])
+    indices = np.concatenate([cols for cols, _ in rows]) if rows else np.zeros(0, dtype=np.int32)
+    data = np.concatenate([values for _, values in rows]) if rows else np.zeros(0)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(userIdxs), ratings.shape[1]))
+
+
+def _rated_mask(matrix):
+    # 1 where a rating is stored; explicit zeros are ratings too
+    mask = matrix.copy()
+    mask.data = np.ones_like(mask.data)
+    return mask
+
+
+def user_based_scores(ratings, userIds, numNeighbors=5):
+    # similarity-weighted neighbor average for a block of users:
+    # W (block x neighbors, each user's neighbor similarities) @ R of those neighbors.
+    # The neighbor search itself is still one lookup per user
+    neighbors = [recommender.nearest_neighbors(ratings, userId, numNeighbors) for userId in userIds]
+    counts = [len(userNeighbors) for userNeighbors in neighbors]
+    neighborIdxs = ratings.user_indexer([neighborId for userNeighbors in neighbors for neighborId, _ in userNeighbors])
+    # only the neighbors' rows, overrides included, so the matrix needn't be compacted
+    uniqueIdxs, columns = np.unique(neighborIdxs, return_inverse=True)
+    weights = sparse.csr_matrix(
+        (np.array([similarity for userNeighbors in neighbors for _, similarity in userNeighbors], dtype=float),
+         columns.astype(np.int32), np.concatenate([[0], np.cumsum(counts)])),
+        shape=(len(userIds), len(uniqueIdxs)))
+    neighborRatings = _block_ratings(ratings, uniqueIdxs)
+    num = (weights @ neighborRatings).toarray()
+    den = (abs(weights) @ _rated_mask(neighborRatings)).toarray()
+    scores = np.divide(num, den, out=np.full(num.shape, np.nan), where=den != 0)
+    return ratings.movieIds, scores
+
+
+def item_based_scores(ratings, userIds):
+    index = recommender.item_similarity_index()
+    return index.movieIds, index.score_users(_block_ratings(ratings, ratings.user_indexer(userIds)))
+
+
+def matrix_factorization_scores(ratings, userIds):
+    # one matrix product of the block's user factors against the item factors
+    model = recommender.matrix_factorization_model()
+    vectors = []
+    for userId in userIds:
+        if model.has_user(userId) and userId not in recommender.Registry.get().changedUsers:
+            vectors.append(model.user_vector(userId))
+        else:
+            cols, values = ratings.user_row(ratings.user_index(userId))
+            vectors.append(model.fold_in(model.movie_indexer(ratings.movieIds[cols]), values))
+    return model.movieIds, (np.array(vectors) @ model.itemFactors.T).astype(float)
+
+
+BLOCK_SCORERS = {'user': user_based_scores, 'item': item_based_scores, 'mf': matrix_factorization_scores}
+
+
+def recommend_batch(userIds, numReccomendations=5, engine='user', blockSize=256):
+    # yields (userId, [movie ids]) block by block, in the order of userIds, falling back
+    # like recommender.recommend: from CF to content and from content to CF, then to the
+    # popular movies, which users the recommender doesn't know get too; scored on one snapshot
+    # of the ratings, so ratings arriving meanwhile don't change it halfway. The
+    # scorers read rows with their overrides, so the snapshot isn't compacted
+    ratings = recommender.current_ratings()
+    for start in range(0, len(userIds), blockSize):
+        block = list(userIds[start:start + blockSize])
+        known = [userId for userId in block if ratings.has_user(userId)]
+        ranked = {}
+        # users with too few ratings for CF are recommended by content, like recommender.recommend does
+        for userId in known:
+            if len(ratings.user_row(ratings.user_index(userId))[0]) < recommender.MIN_CF_RATINGS:
+                recommended = recommender.reccomend_movies_content_based(userId, numReccomendations)[userId]
+                if len(recommended) > 0:
+                    ranked[userId] = recommended
+        known = [userId for userId in known if userId not in ranked]
+        if known:
+            movieIds, scores = BLOCK_SCORERS[engine](ratings, known)
+            # the users' own rated movies are never recommended
+            rated = _block_ratings(ratings, ratings.user_indexer(known)).tocoo()
+            scoreCols = pd.Index(movieIds).get_indexer(ratings.movieIds)[rated.col]
+            scores[rated.row[scoreCols >= 0], scoreCols[scoreCols >= 0]] = np.nan
+            scores[np.isnan(scores)] = -np.inf
+            for userId, top in zip(known, top_k_rows(scores, numReccomendations)):
+                ranked[userId] = movieIds[top].tolist()
+                if len(ranked[userId]) == 0:
+                    ranked[userId] = recommender.reccomend_movies_content_based(userId, numReccomendations)[userId]
+        for userId in block:
+            recommended = ranked.get(userId, [])
+            if len(recommended) == 0:
+                recommended = recommender.popular_unrated_movies(ratings, userId, numReccomendations)
+            yield userId, recommended
+
+
+def compare_single_user(userIds, numReccomendations, engine, blockSize):
+    # per-user cost of the batch path against calling the engine once per user,
+    # after one warm-up block of each so lazily built models aren't timed
+    list(recommend_batch(userIds[:blockSize], numReccomendations, engine, blockSize))
+    for userId in userIds[:blockSize]:
+        recommender.RECOMMENDERS[engine](userId, numReccomendations)
+
+    start = time.perf_counter()
+    batch = dict(recommend_batch(userIds, numReccomendations, engine, blockSize))
+    batchSeconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = {userId: recommender.RECOMMENDERS[engine](userId, numReccomendations)[userId] for userId in userIds}
+    singleSeconds = time.perf_counter() - start
+
+    same = sum(batch[userId] == single[userId] for userId in userIds)
+    print(f"{len(userIds)} users, engine {engine}, block size {blockSize}")
+    print(f"single-user path: {singleSeconds / len(userIds) * 1000:.2f}ms per user")
+    print(f"batch path:       {batchSeconds / len(userIds) * 1000:.2f}ms per user "
+          f"({batchSeconds / singleSeconds:.1%} of single-user)")
+    print(f"identical recommendations for {same} of {len(userIds)} users")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score recommendations for many users, one JSON line per user")
+    parser.add_argument('--engine', default='user', choices=sorted(BLOCK_SCORERS))
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--block-size', type=int, default=256)
+    parser.add_argument('--users', type=int, nargs='*', help="user ids, all users of the matrix by default")
+    parser.add_argument('--output', help="output file, stdout by default")
+    parser.add_argument('--compare', action='store_true',
+                        help="report per-user time against the single-user path instead of writing results")
+    args = parser.parse_args()
+
+    userIds = args.users or recommender.Registry.get().ratings.userIds.tolist()
+    if args.compare:
+        compare_single_user(userIds, args.count, args.engine, args.block_size)
+        raise SystemExit
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    start = time.perf_counter()
+    for userId, movieIds in recommend_batch(userIds, args.count, args.engine, args.block_size):
+        output.write(json.dumps({"userId": userId, "movieIds": movieIds}) + "\n")
+    output.flush()
+    print(f"scored {len(userIds)} users in {time.perf_counter() - start:.2f}s", file=sys.stderr)
@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from ranking import top_k
+
+# Content-based movie similarity from the one-hot genre columns of
+# movies_encoded.csv (written by moviespreprocess.py). Each movie's genre flags
+# are packed into the bits of 64-bit words, so comparing one movie with the
+# whole catalog is an AND/OR plus a popcount per word. Genre similarity
+# (Jaccard or cosine) is blended with how close the release years are.
+
+# share of the score that comes from year proximity, and the year gap at which it drops to 1/e
+YEAR_WEIGHT = 0.2
+YEAR_SCALE = 10.0
+
+METRICS = ('jaccard', 'cosine')
+
+_BYTE_COUNTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    # set bits of every element of a uint64 array
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    counts = _BYTE_COUNTS[words.view(np.uint8)]
+    return counts.reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def pack_flags(flags):
+    # movies x genres 0/1 array -> movies x words uint64 bitsets, genre i in bit i
+    packed = np.packbits(np.asarray(flags, dtype=bool), axis=1, bitorder='little')
+    padding = -packed.shape[1] % 8
+    packed = np.pad(packed, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(packed).view('<u8').astype(np.uint64)
+
+
+def encoded_artifact_path(csvPath):
+    # the binary columns of movies_encoded.csv are written next to it with a .npz extension
+    return os.path.splitext(csvPath)[0] + '.npz'
+
+
+class GenreBitsets:
+
+    def __init__(self, movieIds, genres, bits, years, metric='jaccard'):
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric {metric!r}, expected one of {METRICS}")
+        self.movieIds = np.asarray(movieIds)
+        self.genres = list(genres)
+        self.bits = bits
+        self.years = np.asarray(years, dtype=float)  # NaN where the title has no year
+        self.metric = metric
+        self.genreCounts = popcount(bits).sum(axis=1)
+        self._positions = pd.Index(self.movieIds)
+
+    @classmethod
+    def from_frame(cls, movies, metric='jaccard'):
+        # movies_encoded.csv layout: movieId, title, year, then one 0/1 column per genre
+        genres = [column for column in movies.columns if column not in ('movieId', 'title', 'year')]
+        return cls(movies['movieId'].to_numpy(), genres, pack_flags(movies[genres].to_numpy()),
+                   movies['year'].astype(float).to_numpy(), metric)
+
+    @classmethod
+    def load(cls, path, metric='jaccard'):
+        # prefer the binary columns moviespreprocess.py writes next to the csv, the bits are ready to use
+        binPath = encoded_artifact_path(path)
+        if os.path.exists(binPath):
+            with np.load(binPath) as arrays:
+                years = arrays['years'].astype(float)
+                years[years < 0] = np.nan
+                return cls(arrays['movieIds'], [str(genre) for genre in arrays['genres']], arrays['genreBits'],
+                           years, metric)
+        return cls.from_frame(pd.read_csv(path), metric)
+
+    def __len__(self):
+        return len(self.movieIds)
+
+    def movie_indexer(self, movieIds):
+        # catalog positions of movieIds, -1 where a movie isn't in the catalog
+        return self._positions.get_indexer(movieIds)
+
+    def genre_similarities(self, position):
+        # Jaccard or cosine similarity of one movie's genres with every movie's
+        shared = popcount(self.bits & self.bits[position]).sum(axis=1)
+        if self.metric == 'jaccard':
+            denominator = popcount(self.bits | self.bits[position]).sum(axis=1)
+        else:
+            denominator = np.sqrt(self.genreCounts * float(self.genreCounts[position]))
+        return np.divide(shared, denominator, out=np.zeros(len(self.movieIds)), where=denominator != 0)
+
+    def year_proximity(self, position):
+        # 1 for the same year, decaying with the gap; 0 where either year is unknown
+        proximity = np.exp(-np.abs(self.years - self.years[position]) / YEAR_SCALE)
+        return np.nan_to_num(proximity, nan=0.0)
+
+    def similarities(self, position):
+        return (1 - YEAR_WEIGHT) * self.genre_similarities(position) + YEAR_WEIGHT * self.year_proximity(position)
+
+    def similar_movies(self, movieId, n=10):
+        # the n most similar other movies as (movieId, similarity) pairs, best first;
+        # None if the movie isn't in the catalog
+        position = self.movie_indexer([movieId])[0]
+        if position < 0:
+            return None
+        scores = self.similarities(position)
+        scores[position] = -np.inf
+        top = top_k(scores, n)
+        return list(zip(self.movieIds[top].tolist(), scores[top].tolist()))
+
+    def score(self, movieIds, weights):
+        # weighted average similarity of every catalog movie to the given movies,
+        # NaN for the given movies themselves; movies outside the catalog are skipped
+        positions = self.movie_indexer(movieIds)
+        weights = np.asarray(weights, dtype=float)[positions >= 0]
+        positions = positions[positions >= 0]
+        scores = np.zeros(len(self.movieIds))
+        if len(positions) == 0 or weights.sum() <= 0:
+            return scores
+        for position, weight in zip(positions, weights):
+            scores += weight * self.similarities(position)
+        scores /= weights.sum()
+        scores[positions] = np.nan
+        return scores
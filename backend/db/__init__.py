@@ -0,0 +1,8 @@
+# Data access shared by the API, the scripts and the tests: the ORM models, the
+# process-wide engines and sessions, and the hot queries.
+from db.models import Base, User, Movie, Rating
+from db.engine import database_url, async_url, sync_url, create_engine, get_engine, get_async_engine, open_session, \
+    open_async_session, get_session, dispose_engines
+from db.repository import UPSERT_BATCH_SIZE, rated_movies_query, user_ratings_query, movies_query, \
+    unrated_movies_query, movies_fingerprint_query, all_movies_query, upsert_ratings_statement, rated_movies, \
+    user_ratings, movies, unrated_movies, movies_fingerprint, upsert_ratings, upsert_rating
@@ -0,0 +1,122 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine as sqlalchemy_create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+# One engine per process for each flavour: the async engine the API serves
+# requests on and the sync engine of the scripts and tests. Both are created on
+# first use from DATABASE_URL (or the DB_* variables), written with either
+# driver, and get the same pool and statement cache settings.
+
+# Load environment variables from .env file
+load_dotenv()
+
+# the async driver of each database and the sync driver it replaces
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+# connection pool per engine (not used for sqlite), and checking connections before use
+pool_size = int(os.getenv('DB_POOL_SIZE', '10'))
+max_overflow = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+pool_recycle = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+pool_pre_ping = os.getenv('DB_POOL_PRE_PING', 'true') == 'true'
+# compiled SQL kept by SQLAlchemy per engine, and prepared statements asyncpg keeps per connection
+query_cache_size = int(os.getenv('DB_QUERY_CACHE_SIZE', '1200'))
+statement_cache_size = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '500'))
+
+_engines = {}
+_sessions = {}
+_lock = threading.Lock()
+
+
+def database_url():
+    # DATABASE_URL, or postgres from the DB_* variables
+    return os.getenv('DATABASE_URL', f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@"
+                                     f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
+
+
+def async_url(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    return url.set(drivername=ASYNC_DRIVERS[backend]) if backend in ASYNC_DRIVERS else url
+
+
+def sync_url(url):
+    url = make_url(url)
+    return url.set(drivername=url.get_backend_name()) if url.drivername in ASYNC_DRIVERS.values() else url
+
+
+def engine_options(url):
+    url = make_url(url)
+    options = {'pool_pre_ping': pool_pre_ping, 'query_cache_size': query_cache_size}
+    if url.get_backend_name() != 'sqlite':
+        options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout,
+                       pool_recycle=pool_recycle)
+    return options
+
+
+def create_engine(url):
+    # a sync engine with the settings above, for scripts given their own --database-url
+    return sqlalchemy_create_engine(sync_url(url), **engine_options(url))
+
+
+def create_async(url):
+    url = async_url(url)
+    if url.drivername == 'postgresql+asyncpg':
+        url = url.update_query_dict({'prepared_statement_cache_size': str(statement_cache_size)})
+    return create_async_engine(url, **engine_options(url))
+
+
+def _engine(kind, create):
+    engine = _engines.get(kind)
+    if engine is None:
+        with _lock:
+            if kind not in _engines:
+                _engines[kind] = create(database_url())
+            engine = _engines[kind]
+    return engine
+
+
+def get_engine():
+    # the process's sync engine
+    return _engine('sync', create_engine)
+
+
+def get_async_engine():
+    # the process's async engine
+    return _engine('async', create_async)
+
+
+def open_session():
+    # a new sync session on the process's engine
+    if 'sync' not in _sessions:
+        _sessions['sync'] = sessionmaker(bind=get_engine())
+    return _sessions['sync']()
+
+
+def open_async_session():
+    # a new async session on the process's async engine; objects stay usable after commit
+    if 'async' not in _sessions:
+        _sessions['async'] = async_sessionmaker(get_async_engine(), class_=AsyncSession, expire_on_commit=False)
+    return _sessions['async']()
+
+
+async def get_session():
+    # FastAPI dependency: one session per request, closed when the response is done
+    async with open_async_session() as session:
+        yield session
+
+
+async def dispose_engines():
+    # close the pooled connections, at shutdown
+    engines = dict(_engines)
+    _engines.clear()
+    _sessions.clear()
+    if 'async' in engines:
+        await engines['async'].dispose()
+    if 'sync' in engines:
+        engines['sync'].dispose()
@@ -0,0 +1,55 @@
+from sqlalchemy import ForeignKey, Column, String, Integer, Index
+from sqlalchemy.orm import declarative_base
+
+# The tables of the app, shared by the API, the scripts and the tests.
+
+Base = declarative_base()
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    email = Column("email", String, primary_key=True)
+
+    def __init__(self, email):
+        self.email = email
+
+    # for printing User objects
+    def __repr__(self):
+        return f"{self.email}"
+
+class Movie(Base):
+    __tablename__ = "movies"
+
+    id = Column("id", Integer, primary_key=True, autoincrement=True)
+    name = Column("name",String, nullable=False)
+    description = Column("description", String, nullable=False)
+    imageUrl = Column("imageUrl", String, nullable=False)
+
+    def __init__(self, name, description, imageUrl):
+        self.name = name
+        self.description = description
+        self.imageUrl = imageUrl
+
+    def __repr__(self):
+        return f"({self.id}) {self.name}"
+
+
+class Rating(Base):
+    __tablename__ = "ratings"
+    # one rating per user and movie, the conflict target of the rating upserts, which also
+    # serves the per-user lookups. Existing databases get it from migrate.py
+    __table_args__ = (Index("uq_ratings_user_movie", "userEmail", "movieId", unique=True),)
+
+    id = Column("id", Integer, primary_key=True, autoincrement=True)
+    userEmail = Column(String, ForeignKey("users.email"), nullable=False)  # Reference to User.email
+    movieId = Column(Integer, ForeignKey("movies.id"), nullable=False)
+    rating = Column("rating", Integer, nullable=True)
+
+    def __init__(self, userEmail, movieId, rating):
+        self.userEmail = userEmail
+        self.movieId = movieId
+        self.rating = rating
+
+    def __repr__(self):
+        return f"({self.userEmail}) ({self.movieId}) {self.rating}"
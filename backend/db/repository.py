@@ -0,0 +1,111 @@
+from functools import lru_cache
+
+from sqlalchemy import bindparam, exists, func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db.models import Movie, Rating
+
+# The hot queries. Each statement is built once with bind parameters and bound
+# per call with .params(), so every call has the same cache key and SQLAlchemy
+# compiles it once per engine (and asyncpg prepares it once per connection).
+# The *_query functions return statements, e.g. for EXPLAIN in queryreport.py;
+# the async functions run them on a session.
+
+# rows per upsert batch, well under the bind parameter limits of postgres and sqlite
+UPSERT_BATCH_SIZE = 1000
+
+# the user's ratings through the (userEmail, movieId) index, joined to their movies
+_RATED_MOVIES = select(Movie.id, Movie.name, Movie.description, Rating.rating).select_from(Rating).\
+    join(Movie, Movie.id == Rating.movieId).filter(Rating.userEmail == bindparam('email'))
+
+# every rating of the given users, read from the (userEmail, movieId) index
+_USER_RATINGS = select(Rating.userEmail, Rating.movieId, Rating.rating).\
+    filter(Rating.userEmail.in_(bindparam('emails', expanding=True)))
+
+# the given movies by primary key
+_MOVIES_BY_ID = select(Movie.id, Movie.name, Movie.description).filter(Movie.id.in_(bindparam('movieIds', expanding=True)))
+
+# the given movies the user hasn't rated, an anti-join on the (userEmail, movieId) index
+_UNRATED_MOVIES = _MOVIES_BY_ID.filter(~exists().where(Rating.movieId == Movie.id,
+                                                       Rating.userEmail == bindparam('email')))
+
+# changes when movies are added or removed, or their name or description changes length;
+# sqlite has no hash function, so a same-length rename goes unnoticed there
+_MOVIES_FINGERPRINT = select(func.count(Movie.id), func.max(Movie.id),
+                             func.sum(func.length(Movie.name) + func.length(Movie.description)))
+
+# on postgres: also the md5 of every id, name and description in id order, so any rename shows
+_MOVIES_HASH_FINGERPRINT = select(func.count(Movie.id), func.md5(func.string_agg(
+    func.concat_ws('\t', Movie.id, Movie.name, Movie.description), aggregate_order_by('\n', Movie.id))))
+
+_ALL_MOVIES = select(Movie.id, Movie.name, Movie.description)
+
+
+def rated_movies_query(email):
+    return _RATED_MOVIES.params(email=email)
+
+def user_ratings_query(emails):
+    return _USER_RATINGS.params(emails=list(emails))
+
+def movies_query(movieIds):
+    return _MOVIES_BY_ID.params(movieIds=list(movieIds))
+
+def unrated_movies_query(email, movieIds):
+    return _UNRATED_MOVIES.params(email=email, movieIds=list(movieIds))
+
+def movies_fingerprint_query(dialectName=None):
+    return _MOVIES_HASH_FINGERPRINT if dialectName == 'postgresql' else _MOVIES_FINGERPRINT
+
+def all_movies_query():
+    return _ALL_MOVIES
+
+
+@lru_cache(maxsize=None)
+def upsert_ratings_statement(dialectName):
+    # INSERT ... ON CONFLICT (userEmail, movieId) DO UPDATE, executed with a list of rating
+    # dicts: one statement for any number of rows, no window between a check and the write
+    insert_for_dialect = postgresql_insert if dialectName == 'postgresql' else sqlite_insert
+    statement = insert_for_dialect(Rating)
+    return statement.on_conflict_do_update(index_elements=[Rating.userEmail, Rating.movieId],
+                                           set_={"rating": statement.excluded.rating})
+
+
+def _in_order(rows, movieIds):
+    # rows of movies_query in the order of movieIds
+    byId = {row.id: row for row in rows}
+    return [byId[movieId] for movieId in movieIds if movieId in byId]
+
+
+async def rated_movies(session, email):
+    # (id, name, description, rating) of every movie the user rated
+    return (await session.execute(rated_movies_query(email))).all()
+
+async def user_ratings(session, emails):
+    # (userEmail, movieId, rating) of every rating of the users
+    return (await session.execute(user_ratings_query(emails))).all()
+
+async def movies(session, movieIds):
+    # (id, name, description) of the movies, in the order of movieIds
+    if len(movieIds) == 0:
+        return []
+    return _in_order((await session.execute(movies_query(movieIds))).all(), movieIds)
+
+async def unrated_movies(session, email, movieIds):
+    # movies() without the movies the user rated, e.g. for the non-personal fallback lists
+    if len(movieIds) == 0:
+        return []
+    return _in_order((await session.execute(unrated_movies_query(email, movieIds))).all(), movieIds)
+
+async def movies_fingerprint(session):
+    # a tuple that changes with the movies table, for rebuilding what is derived from it
+    return tuple((await session.execute(movies_fingerprint_query(session.bind.dialect.name))).one())
+
+async def upsert_ratings(session, rows):
+    # insert or update rating dicts (userEmail, movieId, rating); the caller commits
+    statement = upsert_ratings_statement(session.bind.dialect.name)
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        await session.execute(statement, rows[start:start + UPSERT_BATCH_SIZE])
+
+async def upsert_rating(session, email, movieId, rating):
+    await upsert_ratings(session, [{"userEmail": email, "movieId": movieId, "rating": rating}])
@@ -0,0 +1,101 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from scipy import sparse
+from ratingsmatrix import load_ratings_matrix
+
+# Item-item adjusted cosine similarity for item-based collaborative filtering.
+# The matrix is already centered by each user's mean, so adjusted cosine is the
+# cosine between movie columns. Only the top N neighbors of each movie are kept.
+
+
+class ItemSimilarityIndex:
+
+    def __init__(self, movieIds, neighbors, similarities):
+        # neighbors and similarities are movies x N arrays of column positions
+        # and similarities, best first
+        self.movieIds = np.asarray(movieIds)
+        self.neighbors = np.asarray(neighbors, dtype=np.int32)
+        self.similarities = np.asarray(similarities, dtype=np.float32)
+        numMovies, n = self.neighbors.shape
+        similarityMatrix = sparse.csr_matrix(
+            (self.similarities.ravel(), self.neighbors.ravel(), np.arange(0, numMovies * n + 1, n)),
+            shape=(numMovies, numMovies))
+        # row j lists the movies that have j among their top neighbors, which is
+        # what scoring needs when starting from the movies a user rated
+        self._rated_to_scored = similarityMatrix.T.tocsr()
+
+    @classmethod
+    def build(cls, ratings, n=50, blockSize=1024):
+        # cosine of every movie column against all others, one block of movies at a time
+        # so memory stays at blockSize x movies
+        ratings.compact()
+        columns = ratings.csc
+        numMovies = columns.shape[1]
+        n = min(n, max(numMovies - 1, 0))
+        norms = np.sqrt(np.asarray(columns.multiply(columns).sum(axis=0)).ravel())
+        neighbors = np.zeros((numMovies, n), dtype=np.int32)
+        similarities = np.zeros((numMovies, n), dtype=np.float32)
+        for start in range(0, numMovies, blockSize):
+            block = np.arange(start, min(start + blockSize, numMovies))
+            dots = (columns[:, block].T @ columns).toarray()
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cosine = dots / (norms[block, None] * norms[None, :])
+            cosine[~np.isfinite(cosine)] = 0.0
+            cosine[np.arange(len(block)), block] = -np.inf
+            top = np.argpartition(-cosine, n - 1, axis=1)[:, :n] if n > 0 else np.zeros((len(block), 0), int)
+            topSimilarities = np.take_along_axis(cosine, top, axis=1)
+            order = np.argsort(-topSimilarities, axis=1, kind='stable')
+            neighbors[block] = np.take_along_axis(top, order, axis=1)
+            similarities[block] = np.take_along_axis(topSimilarities, order, axis=1)
+        return cls(ratings.movieIds, neighbors, similarities)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(arrays['movieIds'], arrays['neighbors'], arrays['similarities'])
+
+    def save(self, path):
+        tmpPath = f"{path}.tmp.npz"
+        np.savez(tmpPath, movieIds=self.movieIds, neighbors=self.neighbors, similarities=self.similarities)
+        os.replace(tmpPath, path)
+
+    def score(self, ratedCols, ratedValues):
+        # predicted centered rating of every movie from the user's rated movies:
+        # similarity-weighted average over the rated movies among its neighbors,
+        # NaN where none of them are
+        known = ratedCols < len(self.movieIds)
+        rows = self._rated_to_scored[ratedCols[known]]
+        num = rows.T @ np.asarray(ratedValues, dtype=float)[known]
+        den = abs(rows).T @ np.ones(rows.shape[0])
+        return np.divide(num, den, out=np.full(len(num), np.nan), where=den != 0)
+
+    def score_users(self, rated):
+        # score for a block of users at once: rated is a sparse users x movies
+        # matrix of their centered ratings (columns beyond the index are ignored);
+        # returns users x movies, NaN where score would give NaN
+        rated = sparse.csr_matrix(rated)[:, :len(self.movieIds)]
+        mask = rated.copy()
+        mask.data = np.ones_like(mask.data)
+        num = (rated @ self._rated_to_scored).toarray()
+        den = (mask @ abs(self._rated_to_scored)).toarray()
+        return np.divide(num, den, out=np.full(num.shape, np.nan), where=den != 0)
+
+
+def item_similarity_path(csvPath):
+    # the index is written next to the matrix csv it was built from
+    return os.path.splitext(csvPath)[0] + '_items.npz'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute item-item adjusted cosine similarities")
+    parser.add_argument('--matrix', default='centereduseritem_matrix.csv')
+    parser.add_argument('--n', type=int, default=50)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = ItemSimilarityIndex.build(load_ratings_matrix(args.matrix), args.n)
+    index.save(item_similarity_path(args.matrix))
+    print(f"item similarities for {len(index.movieIds)} movies built in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import time
+
+import httpx
+
+# Concurrent throughput of a running API, e.g.
+#   python loadtest.py --url "http://127.0.0.1:8000/all-movies?user_email=test@example.com" --concurrency 50
+
+
+async def run(url, concurrency, requests):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker(client):
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await client.get(url)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{requests} requests, {concurrency} concurrent, {errors} errors")
+    print(f"throughput: {requests / elapsed:.1f} req/s")
+    print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms  "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure concurrent request throughput")
+    parser.add_argument('--url', default="http://127.0.0.1:8000/all-movies?user_email=test@example.com")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.concurrency, args.requests))
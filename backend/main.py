@@ -1,82 +1,42 @@
+import asyncio
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, update, insert, ForeignKey, Column, String, Integer, CHAR
-from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.orm import joinedload
-from reccomendation_algorithim import reccomend_movies
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import db
+from db import User, Rating, get_session
+from resultcache import ResultCache
+from recommendationworkers import RecommendationWorkers
+from batchscoring import recommend_batch
+from moviesearch import MovieSearchIndex
+from reccomendation_algorithim import RECOMMENDERS, Registry, recommender_user_id, update_user_ratings, \
+    start_neighbor_rebuilds, popular_movies, trending_movies, genre_movies, similar_movies, load_models, \
+    reload_models
 
 from typing import List
 
-from sqlalchemy import create_engine
-
 # Load environment variables from .env file
 load_dotenv()
 
-# Retrieve variables from environment
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASSWORD')
-db_host = os.getenv('DB_HOST')
-db_port = os.getenv('DB_PORT')
-db_name = os.getenv('DB_NAME')
-
-
-Base = declarative_base()
-
-
-class User(Base):
-    __tablename__ = "users"
-
-    email = Column("email", String, primary_key=True)
-
-    def __init__(self, email):
-        self.email = email
-
-    # for printing User objects
-    def __repr__(self):
-        return f"{self.email}"
-
-class Movie(Base):
-    __tablename__ = "movies"
-
-    id = Column("id", Integer, primary_key=True, autoincrement=True)
-    name = Column("name",String, nullable=False)
-    description = Column("description", String, nullable=False)
-    imageUrl = Column("imageUrl", String, nullable=False)
-
-    # owner = Column(Integer, ForeignKey("people.ssn"))
-
-    def __init__(self, name, description, imageUrl):
-        self.name = name
-        self.description = description
-        self.imageUrl = imageUrl
-
-    def __repr__(self):
-        return f"({self.id}) {self.name}"
-
-
-class Rating(Base):
-    __tablename__ = "ratings"
-
-    id = Column("id", Integer, primary_key=True, autoincrement=True)
-    userEmail = Column(String, ForeignKey("users.email"), nullable=False)  # Reference to User.email
-    movieId = Column(Integer, ForeignKey("movies.id"), nullable=False)
-    rating = Column("rating", Integer, nullable=True)
-
-    def __init__(self, userEmail, movieId, rating):
-        self.userEmail = userEmail
-        self.movieId = movieId
-        self.rating = rating
+# recommendation engine for /all-movies: "user" or "item" based collaborative filtering,
+# or "mf" for matrix factorization
+recommender_engine = os.getenv('RECOMMENDER_ENGINE', 'user')
+if recommender_engine not in RECOMMENDERS:
+    raise ValueError(f"unknown RECOMMENDER_ENGINE {recommender_engine!r}, expected one of {sorted(RECOMMENDERS)}")
 
-    def __repr__(self):
-        return f"({self.userEmail}) ({self.movieId}) {self.rating}"
+# recommendations per (user, engine, count), dropped when the user rates a movie
+recommendation_cache = ResultCache(maxSize=int(os.getenv('RECOMMENDATION_CACHE_SIZE', '1024')),
+                                   ttlSeconds=float(os.getenv('RECOMMENDATION_CACHE_TTL', '300')))
 
-# connect to postgres    
-database_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-engine = create_engine(database_url)
 
 class UserModel(BaseModel):
     email: str
@@ -86,9 +46,86 @@ class MovieReviewModel(BaseModel):
     movie_id: int
     rating: float
 
-Session = sessionmaker(bind=engine)
-
-app = FastAPI()
+# recommendation scoring is CPU bound, keep it off the event loop in its own threads; so is
+# every other call into the recommender, which can load the models on first use
+recommendation_threads = int(os.getenv('RECOMMENDATION_THREADS', '4'))
+recommendation_executor = ThreadPoolExecutor(max_workers=recommendation_threads, thread_name_prefix="recommendation")
+
+async def run_recommender(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(recommendation_executor, partial(function, *args))
+
+# with RECOMMENDATION_WORKERS > 0 recommendations are scored in that many worker processes,
+# otherwise on the threads above; past the deadline the popular movies are served instead
+recommendation_worker_count = int(os.getenv('RECOMMENDATION_WORKERS', '0'))
+recommendation_deadline = float(os.getenv('RECOMMENDATION_DEADLINE_SECONDS', '2'))
+recommendation_workers = None
+
+# users scored together by /recommendations/batch, and the most users one request can ask for
+batch_block_size = int(os.getenv('BATCH_BLOCK_SIZE', '256'))
+batch_max_users = int(os.getenv('BATCH_MAX_USERS', '1000'))
+
+# the recommender models are loaded at startup unless MODEL_PRELOAD=false (then on the first
+# request); MODEL_WARM_UP=true also scores one recommendation so lazily built parts are ready.
+# It defaults to true for engines whose models can take longer to build than the deadline
+# when they weren't precomputed. With MODEL_RELOAD_SECONDS > 0 rebuilt artifacts on disk are
+# picked up at that interval.
+model_preload = os.getenv('MODEL_PRELOAD', 'true') == 'true'
+model_warm_up = os.getenv('MODEL_WARM_UP', 'true' if recommender_engine in ('item', 'mf') else 'false') == 'true'
+model_reload_seconds = float(os.getenv('MODEL_RELOAD_SECONDS', '0'))
+
+# the precomputed neighbor index is rebuilt from the ratings app users made at most every
+# NEIGHBOR_REBUILD_SECONDS; 0 disables it. Only when scoring in this process: the worker
+# processes score with their own models
+neighbor_rebuild_seconds = float(os.getenv('NEIGHBOR_REBUILD_SECONDS', '300'))
+
+# /search is served from an in-memory index of the movies table, built on the first search;
+# at most every SEARCH_INDEX_CHECK_SECONDS a search checks whether the table changed
+search_index_check_seconds = float(os.getenv('SEARCH_INDEX_CHECK_SECONDS', '60'))
+search_index = None
+search_index_checked = 0.0
+search_index_lock = asyncio.Lock()
+
+def models_reloaded():
+    # recommendations from the previous models are stale; app users are reloaded
+    # from the database on their next request
+    recommendation_cache.clear()
+    recommendation_workers.forget_ratings()
+
+async def watch_models():
+    while True:
+        await asyncio.sleep(model_reload_seconds)
+        if await run_recommender(Registry.reload_if_changed) is not None:
+            models_reloaded()
+
+async def apply_ratings(userId, ratings, replace=False):
+    # (movieId, rating) pairs of one user for the recommender, in this process and in the workers;
+    # with replace they are all the user's ratings
+    await run_recommender(update_user_ratings, userId, ratings, replace)
+    recommendation_workers.record_ratings(userId, ratings, replace)
+
+@asynccontextmanager
+async def lifespan(app):
+    global recommendation_workers
+    if recommendation_worker_count > 0:
+        recommendation_workers = RecommendationWorkers(recommendation_worker_count, recommendation_deadline,
+                                                       popular_movies)
+    else:
+        recommendation_workers = RecommendationWorkers(recommendation_threads, recommendation_deadline,
+                                                       popular_movies, executor=recommendation_executor)
+    if model_preload:
+        await run_recommender(load_models, recommender_engine if model_warm_up else None)
+    watcher = asyncio.create_task(watch_models()) if model_reload_seconds > 0 else None
+    # refresh the precomputed neighbor index in the background as ratings come in
+    if recommendation_worker_count == 0:
+        start_neighbor_rebuilds(neighbor_rebuild_seconds)
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    recommendation_workers.shutdown()
+    recommendation_executor.shutdown(wait=False)
+    await db.dispose_engines()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -99,36 +136,29 @@ app.add_middleware(
 )
 
 @app.get("/")
-def read_root():
-    session = Session()
-    results = session.query(Rating).all() # select everything from people table
+async def read_root(session: AsyncSession = Depends(get_session)):
+    results = (await session.execute(select(Rating))).scalars().all() # select everything from people table
     print(results)
-    session.close()
     return {"Hello": "World"}
 
 class CreateUserRequest(BaseModel):
     email: str
 
 @app.post("/create-user")
-def read_item(user_request: CreateUserRequest):
-    session = Session()
+async def read_item(user_request: CreateUserRequest, session: AsyncSession = Depends(get_session)):
     email = user_request.email
-    query_results = session.query(User).filter(User.email == email).all()
+    query_results = (await session.execute(select(User).filter(User.email == email))).scalars().all()
     if (len(query_results) == 0):
         u = User(email)
         session.add(u)
-        session.commit()
-        session.close()
+        await session.commit()
         return {"status": f"create user {email}"}
-    session.close()
     return {"status": f"user {email} already exists"}
 
 @app.get("/rated-movies")
-def read_item(email: str):
-    session = Session()
-    query_results = session.query( Movie.id, Movie.name, Movie.description , Rating.rating,).join(User, email== Rating.userEmail).join(Movie, Movie.id == Rating.movieId).distinct().all()
+async def read_item(email: str, session: AsyncSession = Depends(get_session)):
+    query_results = await db.rated_movies(session, email)
     result_formatted = [{"id": id, "name": name, "description": description, "rating": rating} for id, name, description, rating in query_results]
-    session.close()
     return {"data": result_formatted}
 
 class UpdateRatingRequest(BaseModel):
@@ -137,61 +167,210 @@ class UpdateRatingRequest(BaseModel):
     newRating: int
 
 @app.post("/rate-movie")
-def update_rating(update_rating_request: UpdateRatingRequest):
-    session = Session()
+async def update_rating(update_rating_request: UpdateRatingRequest, session: AsyncSession = Depends(get_session)):
     email = update_rating_request.email
     movieId = update_rating_request.movieId
     newRating = update_rating_request.newRating
 
-    # Check if the rating already exists
-    existing_rating = session.query(Rating)\
-                             .filter(Rating.userEmail == email, Rating.movieId == movieId)\
-                             .first()
-
-    if existing_rating:
-        # Update the existing rating
-        update_stmt = update(Rating)\
-            .where(Rating.userEmail == email, Rating.movieId == movieId)\
-            .values(rating=newRating)
-        session.execute(update_stmt)
-    else:
-        # Insert a new rating
-        insert_stmt = insert(Rating).values(userEmail=email, movieId=movieId, rating=newRating)
-        session.execute(insert_stmt)
+    await db.upsert_rating(session, email, movieId, newRating)
+    await session.commit()
 
-    session.commit()
-    session.close()
+    # keep the in-memory recommender in step with the database
+    await apply_user_ratings(session, email, [(movieId, newRating)])
 
     return {"result": "success"}
 
+class MovieRating(BaseModel):
+    movieId: int
+    rating: int
+
+class BulkRatingRequest(BaseModel):
+    email: str
+    ratings: List[MovieRating]
+
+@app.post("/rate-movies")
+async def update_ratings(bulk_rating_request: BulkRatingRequest, session: AsyncSession = Depends(get_session)):
+    # many ratings of one user (e.g. an imported watch history) in batched upserts;
+    # a movie listed more than once keeps its last rating
+    email = bulk_rating_request.email
+    ratings = {movie_rating.movieId: movie_rating.rating for movie_rating in bulk_rating_request.ratings}
+    rows = [{"userEmail": email, "movieId": movieId, "rating": rating} for movieId, rating in ratings.items()]
+    await db.upsert_ratings(session, rows)
+    await session.commit()
+
+    if len(rows) > 0:
+        await apply_user_ratings(session, email, list(ratings.items()))
+
+    return {"result": "success", "count": len(rows)}
+
+async def recommender_users_for(session, emails):
+    # {email: recommender id} for the users that have ratings; users whose ratings aren't
+    # in the recommender yet (e.g. after a restart) are loaded from the database, in one query
+    userIds = await run_recommender(lambda: {email: recommender_user_id(email) for email in emails})
+    missing = [email for email, userId in userIds.items() if userId is None]
+    if len(missing) > 0:
+        ratings = await db.user_ratings(session, missing)
+        by_email = {}
+        for email, movieId, rating in ratings:
+            by_email.setdefault(email, []).append((movieId, rating))
+        for email, user_ratings in by_email.items():
+            userIds[email] = await run_recommender(recommender_user_id, email, True)
+            await apply_ratings(userIds[email], user_ratings, replace=True)
+    return {email: userId for email, userId in userIds.items() if userId is not None}
+
+async def recommender_user_for(session, email):
+    return (await recommender_users_for(session, [email])).get(email)
+
+async def apply_user_ratings(session, email, ratings):
+    # new (movieId, rating) pairs of a user, already committed, for the recommender; a user
+    # whose ratings aren't loaded yet (e.g. after a restart) is loaded with all their stored
+    # ratings instead, which include the new ones
+    userId = await run_recommender(recommender_user_id, email)
+    if userId is None:
+        userId = await recommender_user_for(session, email)
+    elif recommendation_workers.has_ratings(userId):
+        await apply_ratings(userId, ratings)
+    else:
+        # the worker processes get a user's whole rating set, e.g. on a seeded user's
+        # first rating since startup, and load it the way users are loaded here
+        stored = [(movieId, rating) for _, movieId, rating in await db.user_ratings(session, [email])]
+        await apply_ratings(userId, stored, replace=True)
+    if userId is not None:
+        recommendation_cache.invalidate_user(userId)
+
 @app.get("/all-movies")
-def get_movies(user_email: str):
-    session = Session()
-
-    # Subquery to find movie IDs rated by the user
-    rated_movie_ids = session.query(Rating.movieId).filter(Rating.userEmail == user_email).subquery()
-    print("rated movie ids all", session.query(rated_movie_ids).all())
-
-    for movie_id in session.query(rated_movie_ids).all():
-        print("MOVIE ID",movie_id)
-
-    # Query to find movies not rated by the user
-    query_results = session.query(Movie.id, Movie.name, Movie.description,Rating.rating).\
-                outerjoin(Rating, Movie.id == Rating.movieId).\
-                filter(~Movie.id.in_(rated_movie_ids)).\
-                all()
-    
-    result_formatted = [{"id": movie.id, "name": movie.name, "description": movie.description, "rating": movie.rating} 
-                        for movie in query_results]
-    print("results formatted", result_formatted[0])
+async def get_movies(user_email: str, session: AsyncSession = Depends(get_session)):
+    userId = await recommender_user_for(session, user_email)
+    if userId is None:
+        # no ratings yet, nothing to personalize on: the precomputed popular movies
+        recommended_ids = await run_recommender(popular_movies, 7)
+        query_results = await db.movies(session, recommended_ids)
+        return {"data": [{"id": movie.id, "name": movie.name, "description": movie.description, "rating": None}
+                         for movie in query_results]}
+
+    # the generation taken before the lookup keeps a result that a rating made meanwhile
+    # has outdated from being cached
+    generation = recommendation_cache.generation(userId)
+    recommended_ids = recommendation_cache.get(userId, recommender_engine, 7)
+    fallback = False
+    if recommended_ids is None:
+        recommended_ids, fallback = await recommendation_workers.recommend(userId, 7, recommender_engine)
+        if not fallback:
+            recommendation_cache.put(userId, recommender_engine, 7, value=recommended_ids, generation=generation)
+    if len(recommended_ids) == 0:
+        return {"data": []}
+
+    # fetch only the recommended movies, in recommendation order; the fallback list
+    # isn't personal and can contain movies the user already rated
+    if fallback:
+        query_results = await db.unrated_movies(session, user_email, recommended_ids)
+    else:
+        query_results = await db.movies(session, recommended_ids)
 
-    v = reccomend_movies(1,7)
-    recommended_ids = v[1]
-    recommended_ids_int = [int(id) for id in recommended_ids]
-    filtered_movies = [movie for movie in result_formatted if movie['id'] in recommended_ids_int]
+    result_formatted = [{"id": movie.id, "name": movie.name, "description": movie.description, "rating": None}
+                        for movie in query_results]
+    return {"data": result_formatted}
 
+@app.get("/popular-movies")
+async def get_popular_movies(genre: str = None, trending: bool = False, count: int = Query(7, ge=1, le=100),
+                             session: AsyncSession = Depends(get_session)):
+    # browse lists that need no ratings: popular overall or in a genre, or trending
+    if genre is not None:
+        movieIds = await run_recommender(genre_movies, genre, count)
+        if movieIds is None:
+            raise HTTPException(status_code=404, detail=f"no popularity list for genre {genre}")
+    else:
+        movieIds = await run_recommender(trending_movies if trending else popular_movies, count)
+    query_results = await db.movies(session, movieIds)
+    result_formatted = [{"id": movie.id, "name": movie.name, "description": movie.description, "rating": None}
+                        for movie in query_results]
+    return {"data": result_formatted}
 
-    
+@app.get("/similar-movies/{movie_id}")
+async def get_similar_movies(movie_id: int, count: int = Query(7, ge=1, le=100),
+                             session: AsyncSession = Depends(get_session)):
+    # "more like this": movies with similar genres and release years
+    similar = await run_recommender(similar_movies, movie_id, count)
+    if similar is None:
+        raise HTTPException(status_code=404, detail=f"movie {movie_id} not found")
+    similarity = dict(similar)
+    query_results = await db.movies(session, list(similarity))
+    result_formatted = [{"id": movie.id, "name": movie.name, "description": movie.description, "rating": None,
+                         "similarity": similarity[movie.id]} for movie in query_results]
+    return {"data": result_formatted}
 
-    session.close()
-    return {"data": filtered_movies}
\ No newline at end of file
+class BatchRecommendationRequest(BaseModel):
+    emails: List[str] = Field(max_length=batch_max_users)
+    count: int = Field(7, ge=1, le=100)
+
+@app.post("/recommendations/batch")
+async def batch_recommendations(batch_request: BatchRecommendationRequest, session: AsyncSession = Depends(get_session)):
+    # recommendations for many users (digests, cache warming), scored a block of users at a
+    # time and streamed back as one JSON line per email as each block finishes; users without
+    # ratings get the popular movies, as from /all-movies
+    emails = list(dict.fromkeys(batch_request.emails))
+    count = batch_request.count
+    userIds = await recommender_users_for(session, emails)
+    popular = await run_recommender(popular_movies, count) if len(userIds) < len(emails) else []
+
+    async def lines():
+        for start in range(0, len(emails), batch_block_size):
+            block_emails = emails[start:start + batch_block_size]
+            block_ids = [userIds[email] for email in block_emails if email in userIds]
+            generations = {userId: recommendation_cache.generation(userId) for userId in block_ids}
+            recommended = dict(await run_recommender(
+                lambda: list(recommend_batch(block_ids, count, recommender_engine, batch_block_size))))
+            for email in block_emails:
+                movieIds = recommended.get(userIds.get(email), popular)
+                if email in userIds:
+                    recommendation_cache.put(userIds[email], recommender_engine, count, value=movieIds,
+                                             generation=generations[userIds[email]])
+                yield json.dumps({"email": email, "movieIds": movieIds}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+async def current_search_index(session):
+    # the search index, rebuilt from the movies table when its fingerprint changed
+    global search_index, search_index_checked
+    now = asyncio.get_running_loop().time()
+    if search_index is not None and now - search_index_checked < search_index_check_seconds:
+        return search_index
+    async with search_index_lock:
+        if search_index is None or now - search_index_checked >= search_index_check_seconds:
+            fingerprint = await db.movies_fingerprint(session)
+            if search_index is None or search_index.fingerprint != fingerprint:
+                movies = (await session.execute(db.all_movies_query())).all()
+                search_index = await run_recommender(MovieSearchIndex, movies, fingerprint)
+            search_index_checked = now
+    return search_index
+
+@app.get("/search")
+async def search_movies(q: str = "", year: int = None, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=100),
+                        session: AsyncSession = Depends(get_session)):
+    # movies whose title words or genres start with every word of q, best matches first
+    index = await current_search_index(session)
+    total, movies = index.search(q, year, offset, limit)
+    result_formatted = [dict(movie, rating=None) for movie in movies]
+    return {"data": result_formatted, "total": total, "offset": offset, "limit": limit}
+
+@app.get("/cache-stats")
+async def cache_stats():
+    # hit/miss/eviction counters of the recommendation cache, for sizing it
+    return recommendation_cache.stats()
+
+@app.get("/models")
+async def model_stats():
+    # which artifacts are loaded and how long loading them took
+    return Registry.stats()
+
+@app.post("/models/reload")
+async def reload_model_artifacts():
+    # load the artifacts again, e.g. after the build scripts wrote a new version
+    await run_recommender(reload_models)
+    models_reloaded()
+    return Registry.stats()
+
+@app.get("/worker-stats")
+async def worker_stats():
+    # queue depth, utilization and coalescing/deadline counters of the recommendation workers
+    return recommendation_workers.stats()
@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Matrix factorization recommender: the centered ratings are approximated by
+# userFactors @ itemFactors.T, trained with alternating least squares. Scoring a
+# user is one vector-matrix product against the item factors.
+
+
+class MatrixFactorization:
+
+    def __init__(self, userIds, movieIds, userFactors, itemFactors, regularization=0.1):
+        self.userIds = np.asarray(userIds)
+        self.movieIds = np.asarray(movieIds)
+        self.userFactors = np.asarray(userFactors, dtype=np.float32)
+        self.itemFactors = np.asarray(itemFactors, dtype=np.float32)
+        self.regularization = float(regularization)
+        self._userPositions = pd.Index(self.userIds)
+        self._moviePositions = pd.Index(self.movieIds)
+
+    @classmethod
+    def train(cls, ratings, factors=32, iterations=10, regularization=0.1, seed=0):
+        # ALS with weighted-lambda regularization on a RatingsMatrix
+        ratings.compact()
+        rows, columns = ratings.csr, ratings.csc
+        rng = np.random.default_rng(seed)
+        userFactors = np.zeros((rows.shape[0], factors))
+        itemFactors = rng.normal(scale=0.1, size=(rows.shape[1], factors))
+        for _ in range(iterations):
+            _solve_factors(rows, itemFactors, userFactors, regularization)
+            _solve_factors(columns.T.tocsr(), userFactors, itemFactors, regularization)
+        return cls(ratings.userIds, ratings.movieIds, userFactors, itemFactors, regularization)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(arrays['userIds'], arrays['movieIds'], arrays['userFactors'], arrays['itemFactors'],
+                       arrays['regularization'])
+
+    def save(self, path):
+        tmpPath = f"{path}.tmp.npz"
+        np.savez(tmpPath, userIds=self.userIds, movieIds=self.movieIds, userFactors=self.userFactors,
+                 itemFactors=self.itemFactors, regularization=self.regularization)
+        os.replace(tmpPath, path)
+
+    def has_user(self, userId):
+        return userId in self._userPositions
+
+    def user_vector(self, userId):
+        return self.userFactors[self._userPositions.get_loc(userId)]
+
+    def movie_indexer(self, movieIds):
+        # factor rows of the movie ids, -1 for movies the model was not trained on
+        return self._moviePositions.get_indexer(movieIds)
+
+    def fold_in(self, movieIdxs, values):
+        # factors for a user the model was not trained on (or whose ratings
+        # changed since), solved from their centered ratings with the items fixed
+        known = movieIdxs >= 0
+        items = self.itemFactors[movieIdxs[known]].astype(float)
+        if len(items) == 0:
+            return np.zeros(self.itemFactors.shape[1], dtype=np.float32)
+        gram = items.T @ items + self.regularization * len(items) * np.eye(items.shape[1])
+        return np.linalg.solve(gram, items.T @ np.asarray(values, dtype=float)[known]).astype(np.float32)
+
+    def scores(self, userVector):
+        # predicted centered rating of every movie
+        return self.itemFactors @ userVector
+
+
+def _solve_factors(matrix, fixed, solved, regularization):
+    # one ALS half-step: row i of solved = argmin ||r_i - solved_i @ fixed.T||^2 + lambda * n_i * ||solved_i||^2
+    # over the entries stored in row i of matrix
+    eye = np.eye(fixed.shape[1])
+    for i in range(matrix.shape[0]):
+        start, end = matrix.indptr[i], matrix.indptr[i + 1]
+        if start == end:
+            solved[i] = 0.0
+            continue
+        rated = fixed[matrix.indices[start:end]]
+        gram = rated.T @ rated + regularization * (end - start) * eye
+        solved[i] = np.linalg.solve(gram, rated.T @ matrix.data[start:end])
+
+
+def matrix_factorization_path(csvPath):
+    # the factors are written next to the matrix csv they were trained for
+    return os.path.splitext(csvPath)[0] + '_mf.npz'
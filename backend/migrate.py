@@ -0,0 +1,55 @@
+import argparse
+import os
+
+from sqlalchemy import inspect, text
+
+from db import create_engine, database_url
+
+# Schema changes for databases created before the models gained them. Every
+# migration runs once, in its own transaction, and is recorded in
+# schema_migrations; databases created from the current models by create_all
+# already have them, and the statements are written so that is harmless.
+#   python migrate.py [--database-url sqlite:///local_database.db]
+
+MIGRATIONS = [
+    (1, "one rating per user and movie", [
+        # keep the latest of any duplicate ratings before the unique index can be built
+        'DELETE FROM ratings WHERE id NOT IN (SELECT MAX(id) FROM ratings GROUP BY "userEmail", "movieId")',
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_ratings_user_movie ON ratings ("userEmail", "movieId")',
+    ]),
+]
+
+
+def migrate(engine):
+    # apply the migrations the database doesn't have yet; returns their versions
+    if not inspect(engine).has_table("ratings"):
+        raise RuntimeError("no ratings table, create the database with seed-db.py first")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations "
+                                "(version INTEGER PRIMARY KEY, description VARCHAR NOT NULL)"))
+        applied = set(connection.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+    newly_applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as connection:
+            for statement in statements:
+                connection.execute(text(statement))
+            connection.execute(text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                               {"version": version, "description": description})
+        newly_applied.append(version)
+    return newly_applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument('--database-url', default=os.getenv('MIGRATION_DATABASE_URL', database_url()))
+    args = parser.parse_args()
+
+    applied = migrate(create_engine(args.database_url))
+    descriptions = dict((version, description) for version, description, _ in MIGRATIONS)
+    for version in applied:
+        print(f"applied migration {version}: {descriptions[version]}")
+    if not applied:
+        print("database is up to date")
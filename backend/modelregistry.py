@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+from ratingsmatrix import load_ratings_matrix, artifact_path
+from similarity import SimilarityCache
+from neighborindex import NeighborIndex, neighbor_index_path
+from itemsimilarity import ItemSimilarityIndex, item_similarity_path
+from matrixfactorization import MatrixFactorization, matrix_factorization_path
+from popularitytables import PopularityTables, popularity_path
+
+# Lazily loaded recommender models. Models is one consistent set of artifacts
+# (ratings matrix, neighbor index, item similarities, factors, popularity tables) together with the
+# state that belongs to them. ModelRegistry loads the set on first use, or when
+# asked to at startup, and swaps in a new set when the artifacts on disk change;
+# a request that already holds the old set finishes with it.
+
+# memory for cached similarity rows; each row is 8 bytes per user of the matrix and
+# every rating write copies all cached rows, so this bounds the cost of a write too
+SIMILARITY_CACHE_MB = float(os.getenv('SIMILARITY_CACHE_MB', '16'))
+
+
+def artifact_paths(matrixPath):
+    return [matrixPath, artifact_path(matrixPath), neighbor_index_path(matrixPath),
+            item_similarity_path(matrixPath), matrix_factorization_path(matrixPath), popularity_path(matrixPath)]
+
+
+def artifact_version(matrixPath):
+    # modification times of the artifacts that exist; changes when any is rebuilt
+    return tuple((path, os.stat(path).st_mtime_ns) for path in artifact_paths(matrixPath) if os.path.exists(path))
+
+
+def _load_if_exists(cls, path):
+    return cls.load(path) if os.path.exists(path) else None
+
+
+class Models:
+
+    def __init__(self, matrixPath):
+        start = time.perf_counter()
+        self.matrixPath = matrixPath
+        self.version = artifact_version(matrixPath)
+        self.ratings = load_ratings_matrix(matrixPath)
+        # similarity rows computed by neighbor searches, kept in sync by update_user_rating
+        self.similarities = SimilarityCache(self.ratings, maxBytes=SIMILARITY_CACHE_MB * 2**20)
+        # precomputed neighbors, item similarities and factors; the item index and the
+        # factors are built on first use when they haven't been precomputed
+        self.neighbors = _load_if_exists(NeighborIndex, neighbor_index_path(matrixPath))
+        self.itemSimilarities = _load_if_exists(ItemSimilarityIndex, item_similarity_path(matrixPath))
+        self.factors = _load_if_exists(MatrixFactorization, matrix_factorization_path(matrixPath))
+        # popularity, trending and per-genre rankings from popularitytables.py, if they were built
+        self.popularity = _load_if_exists(PopularityTables, popularity_path(matrixPath))
+        # users rated since the neighbor index was built, and the app users (emails)
+        # whose ratings have been loaded into these models
+        self.changedUsers = set()
+        self.appUsers = set()
+        self.popularMovieIds = None
+        # genre bitsets of the catalog, loaded on first content-based recommendation
+        self.contentSimilarity = None
+        self.loadSeconds = time.perf_counter() - start
+
+
+class ModelRegistry:
+
+    def __init__(self, matrixPath):
+        self.matrixPath = matrixPath
+        self.reloads = 0
+        self._models = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._models is not None
+
+    def get(self):
+        # the current model set, loading it on first use
+        models = self._models
+        if models is None:
+            with self._lock:
+                if self._models is None:
+                    self._models = Models(self.matrixPath)
+                models = self._models
+        return models
+
+    def reload(self, matrixPath=None):
+        # load a new set (optionally from another matrix) and swap it in with one assignment
+        with self._lock:
+            if matrixPath is not None:
+                self.matrixPath = matrixPath
+            models = Models(self.matrixPath)
+            self._models = models
+            self.reloads += 1
+        return models
+
+    def reload_if_changed(self):
+        # a stat per artifact; returns the new set if one was loaded, else None
+        models = self._models
+        if models is None or models.version == artifact_version(self.matrixPath):
+            return None
+        with self._lock:
+            if self._models is not models:
+                # another thread reloaded in the meantime
+                return None
+            self._models = Models(self.matrixPath)
+            self.reloads += 1
+            return self._models
+
+    def stats(self):
+        models = self._models
+        if models is None:
+            return {"loaded": False, "matrixPath": self.matrixPath, "reloads": self.reloads}
+        return {"loaded": True, "matrixPath": models.matrixPath, "reloads": self.reloads,
+                "loadSeconds": models.loadSeconds, "users": int(models.ratings.shape[0]),
+                "movies": int(models.ratings.shape[1]), "neighborIndex": models.neighbors is not None,
+                "itemSimilarities": models.itemSimilarities is not None, "factors": models.factors is not None,
+                "contentSimilarity": models.contentSimilarity is not None,
+                "popularityTables": models.popularity is not None}
@@ -0,0 +1,106 @@
+from bisect import bisect_left
+
+import numpy as np
+
+from moviespreprocess import extractYear, cleanTitle
+from ranking import top_k
+
+# In-memory inverted index for movie search. Titles are normalized with
+# moviespreprocess.cleanTitle and split into words, genres (the "|" separated
+# movie descriptions) are added as words of their own. The sorted vocabulary
+# keeps the postings of all words sharing a prefix next to each other, so a
+# prefix is one bisect and one contiguous slice of the postings.
+
+# score of a title word and a genre match, and the bonus when the query word is the whole word
+TITLE_WEIGHT = 2.0
+GENRE_WEIGHT = 1.0
+EXACT_BONUS = 1.0
+
+NO_GENRES = "(no genres listed)"
+
+
+def search_words(text):
+    return cleanTitle(text).split()
+
+
+def genre_words(description):
+    return [word for genre in description.split('|') if genre != NO_GENRES for word in search_words(genre)]
+
+
+class MovieSearchIndex:
+
+    def __init__(self, movies=(), fingerprint=None):
+        # movies: (id, name, description) rows; fingerprint identifies the table contents indexed
+        self.fingerprint = fingerprint
+        self.ids, self.names, self.descriptions, years = [], [], [], []
+        words = {}  # word -> ([movie positions], [weights])
+        for position, (movieId, name, description) in enumerate(movies):
+            self.ids.append(movieId)
+            self.names.append(name)
+            self.descriptions.append(description)
+            years.append(extractYear(name) or -1)
+            for weight, movieWords in ((TITLE_WEIGHT, search_words(name)), (GENRE_WEIGHT, genre_words(description))):
+                for word in movieWords:
+                    positions, weights = words.setdefault(word, ([], []))
+                    positions.append(position)
+                    weights.append(weight)
+        self.years = np.array(years, dtype=np.int32)
+
+        self.vocabulary = sorted(words)
+        lengths = [len(words[word][0]) for word in self.vocabulary]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        self.postings = np.array([p for word in self.vocabulary for p in words[word][0]], dtype=np.int32)
+        self.weights = np.array([w for word in self.vocabulary for w in words[word][1]], dtype=np.float64)
+
+        # equally scored movies rank shorter titles first, then alphabetically
+        order = sorted(range(len(self.ids)), key=lambda position: (len(self.names[position]), self.names[position]))
+        self._tieRank = np.empty(len(self.ids), dtype=np.float64)
+        self._tieRank[order] = np.arange(len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _word_range(self, word, prefix):
+        # vocabulary positions [start, end) of the word, or of every word starting with it
+        start = bisect_left(self.vocabulary, word)
+        if not prefix:
+            return start, start + 1 if start < len(self.vocabulary) and self.vocabulary[start] == word else start
+        end = bisect_left(self.vocabulary, word[:-1] + chr(ord(word[-1]) + 1))
+        return start, end
+
+    def _word_scores(self, word):
+        # score of every movie for one query word, 0 where no word of the movie starts with it
+        start, end = self._word_range(word, prefix=True)
+        low, high = self.offsets[start], self.offsets[end]
+        scores = np.bincount(self.postings[low:high], self.weights[low:high], minlength=len(self.ids))
+        exactStart, exactEnd = self._word_range(word, prefix=False)
+        if exactEnd > exactStart:
+            low, high = self.offsets[exactStart], self.offsets[exactEnd]
+            scores += np.bincount(self.postings[low:high], minlength=len(self.ids)) * EXACT_BONUS
+        return scores
+
+    def search(self, query, year=None, offset=0, limit=20):
+        # (total matches, page of matches best first); every query word must prefix-match a
+        # title word or genre of the movie. An empty query lists the movies of the year
+        words = search_words(query)
+        if len(words) == 0 and year is None:
+            return 0, []
+        scores = np.zeros(len(self.ids))
+        matches = np.ones(len(self.ids), dtype=bool)
+        for word in words:
+            wordScores = self._word_scores(word)
+            matches &= wordScores > 0
+            scores += wordScores
+        if year is not None:
+            matches &= self.years == year
+
+        candidates = np.flatnonzero(matches)
+        # score first, the tie rank breaks ties; both fit in one key
+        keys = scores[candidates] * len(self.ids) - self._tieRank[candidates]
+        page = candidates[top_k(keys, offset + limit)[offset:]]
+        return len(candidates), [self.movie(position) for position in page]
+
+    def movie(self, position):
+        year = int(self.years[position])
+        return {"id": self.ids[position], "name": self.names[position], "description": self.descriptions[position],
+                "year": year if year >= 0 else None}
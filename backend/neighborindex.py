@@ -0,0 +1,140 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from ratingsmatrix import load_ratings_matrix
+from similarity import user_similarities
+from ranking import top_k
+
+# Precomputed top-K nearest neighbors for every user of a RatingsMatrix.
+# Row i holds the neighbor user ids and similarities of userIds[i], best
+# first, in the same order find_nearest_neighbor would return them.
+
+
+class NeighborIndex:
+
+    def __init__(self, userIds, neighborIds, similarities):
+        self.userIds = np.asarray(userIds)
+        self.neighborIds = np.asarray(neighborIds)
+        self.similarities = np.asarray(similarities, dtype=float)
+        self._positions = {userId: i for i, userId in enumerate(self.userIds.tolist())}
+
+    @property
+    def k(self):
+        return self.neighborIds.shape[1]
+
+    @classmethod
+    def build(cls, ratings, k=20, workers=1):
+        # With workers > 1 the users are split into blocks that a process pool
+        # scores independently; every worker gets its own copy of the matrix.
+        numUsers = ratings.shape[0]
+        k = min(k, max(numUsers - 1, 0))
+        blocks = np.array_split(np.arange(numUsers), max(workers * 4, 1))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(ratings,)) as pool:
+                results = list(pool.map(_build_block, blocks, [k] * len(blocks)))
+        else:
+            _init_worker(ratings)
+            results = [_build_block(block, k) for block in blocks]
+
+        neighborIdxs = np.concatenate([idxs for idxs, _ in results])
+        similarities = np.concatenate([sims for _, sims in results])
+        return cls(ratings.userIds, ratings.userIds[neighborIdxs], similarities)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(arrays['userIds'], arrays['neighborIds'], arrays['similarities'])
+
+    def save(self, path):
+        # np.savez appends .npz to names without it, so write to a .npz temp file
+        tmpPath = f"{path}.tmp.npz"
+        np.savez(tmpPath, userIds=self.userIds, neighborIds=self.neighborIds, similarities=self.similarities)
+        os.replace(tmpPath, path)
+
+    def has_user(self, userId):
+        return userId in self._positions
+
+    def neighbors(self, userId, numNeighbors):
+        # (neighbor ids, similarities) of the user's best numNeighbors, an O(1) row read
+        row = self._positions[userId]
+        return self.neighborIds[row, :numNeighbors], self.similarities[row, :numNeighbors]
+
+
+def top_neighbors(similarities, userIdx, k):
+    # row positions and similarities of the k most similar other users,
+    # ties kept in user order
+    others = np.delete(np.arange(len(similarities)), userIdx)
+    order = others[top_k(similarities[others], k)]
+    return order, similarities[order]
+
+
+def predict_from_neighbors(ratings, neighborIdxs, similarities, movieIdxs):
+    # similarity-weighted average of the neighbors' ratings of each movie,
+    # over the neighbors that rated it; NaN where none did
+    neighborRatings = ratings.dense_rows(neighborIdxs, movieIdxs)
+    rated = ~np.isnan(neighborRatings)
+    num = similarities @ np.where(rated, neighborRatings, 0.0)
+    den = np.abs(similarities) @ rated
+    return np.divide(num, den, out=np.full(len(num), np.nan), where=den != 0)
+
+
+# matrix used by _build_block, set once per worker process by _init_worker
+_worker_ratings = None
+
+
+def _init_worker(ratings):
+    global _worker_ratings
+    _worker_ratings = ratings
+
+
+def _build_block(userIdxs, k):
+    neighborIdxs = np.zeros((len(userIdxs), k), dtype=np.int64)
+    similarities = np.zeros((len(userIdxs), k))
+    for row, userIdx in enumerate(userIdxs):
+        neighborIdxs[row], similarities[row] = top_neighbors(user_similarities(_worker_ratings, userIdx),
+                                                             userIdx, k)
+    return neighborIdxs, similarities
+
+
+def scaling_report(ratings, k, maxWorkers):
+    # build time for 1, 2, 4, ... maxWorkers workers
+    workers = 1
+    baseline = None
+    while True:
+        start = time.perf_counter()
+        NeighborIndex.build(ratings, k, workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:3d} workers: {elapsed:6.2f}s  speedup {baseline / elapsed:4.2f}x")
+        if workers >= maxWorkers:
+            break
+        workers = min(workers * 2, maxWorkers)
+
+
+def neighbor_index_path(csvPath):
+    # the index is written next to the matrix csv it was built from
+    return os.path.splitext(csvPath)[0] + '_neighbors.npz'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the top-K neighbor index")
+    parser.add_argument('--matrix', default='centereduseritem_matrix.csv')
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--scaling', action='store_true',
+                        help="report build time from 1 to --workers workers instead of saving")
+    args = parser.parse_args()
+
+    ratings = load_ratings_matrix(args.matrix)
+    if args.scaling:
+        scaling_report(ratings, args.k, args.workers)
+        raise SystemExit
+
+    start = time.perf_counter()
+    index = NeighborIndex.build(ratings, args.k, args.workers)
+    index.save(neighbor_index_path(args.matrix))
+    print(f"neighbor index for {len(index.userIds)} users built in {time.perf_counter() - start:.2f}s")
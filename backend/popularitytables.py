@@ -0,0 +1,113 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Precomputed non-personalized rankings for users the recommender knows nothing
+# about yet, and for when personal scoring misses its deadline. Built offline
+# from ratings.csv (including the timestamps the matrix preprocessing drops):
+#   popular  - Bayesian average rating, (m * C + sum) / (m + count), which pulls
+#              movies with few ratings towards the global mean C
+#   trending - ratings weighted by recency, halving every halfLifeDays before the
+#              newest rating, and by how high they are
+#   genre    - the popular ranking within each genre
+# Each ranking is a plain array of movie ids best first, so serving the top n is a slice.
+
+
+class PopularityTables:
+
+    def __init__(self, popularIds, popularScores, trendingIds, trendingScores, genres, genreOffsets, genreMovieIds):
+        self.popularIds = np.asarray(popularIds)
+        self.popularScores = np.asarray(popularScores)
+        self.trendingIds = np.asarray(trendingIds)
+        self.trendingScores = np.asarray(trendingScores)
+        # top lists of all genres back to back; genre i is genreMovieIds[genreOffsets[i]:genreOffsets[i + 1]]
+        self.genres = [str(genre) for genre in genres]
+        self.genreOffsets = np.asarray(genreOffsets)
+        self.genreMovieIds = np.asarray(genreMovieIds)
+        self._genrePositions = {genre.lower(): position for position, genre in enumerate(self.genres)}
+
+    @classmethod
+    def build(cls, ratings, movies=None, top=500, priorVotes=None, halfLifeDays=180.0):
+        # ratings: userId, movieId, rating, timestamp rows; movies: movieId and "|" separated genres
+        byMovie = ratings.groupby('movieId')['rating'].agg(['sum', 'count'])
+        globalMean = ratings['rating'].mean()
+        # by default a movie needs as many ratings as the average movie has to be judged on its own
+        priorVotes = byMovie['count'].mean() if priorVotes is None else priorVotes
+        bayesian = (priorVotes * globalMean + byMovie['sum']) / (priorVotes + byMovie['count'])
+        popular = bayesian.sort_values(ascending=False, kind='stable')
+
+        ageDays = (ratings['timestamp'].max() - ratings['timestamp']) / 86400.0
+        recency = np.power(0.5, ageDays / halfLifeDays) * ratings['rating'] / ratings['rating'].max()
+        trending = recency.groupby(ratings['movieId']).sum().sort_values(ascending=False, kind='stable')
+
+        genres, offsets, genreMovieIds = [], [0], []
+        if movies is not None:
+            movieGenres = movies.set_index('movieId')['genres'].str.split('|').explode()
+            movieGenres = movieGenres[movieGenres != '(no genres listed)']
+            rank = pd.Series(np.arange(len(popular)), index=popular.index)
+            for genre, genreMovies in movieGenres.groupby(movieGenres):
+                ranked = rank.reindex(genreMovies.index).dropna().sort_values().index[:top]
+                genres.append(genre)
+                genreMovieIds.extend(ranked)
+                offsets.append(len(genreMovieIds))
+
+        return cls(popular.index[:top].to_numpy(), popular.to_numpy()[:top],
+                   trending.index[:top].to_numpy(), trending.to_numpy()[:top],
+                   genres, np.array(offsets, dtype=np.int64), np.array(genreMovieIds, dtype=popular.index.dtype))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(arrays['popularIds'], arrays['popularScores'], arrays['trendingIds'], arrays['trendingScores'],
+                       arrays['genres'], arrays['genreOffsets'], arrays['genreMovieIds'])
+
+    def save(self, path):
+        # np.savez appends .npz to names without it, so write to a .npz temp file
+        tmpPath = f"{path}.tmp.npz"
+        np.savez(tmpPath, popularIds=self.popularIds, popularScores=self.popularScores,
+                 trendingIds=self.trendingIds, trendingScores=self.trendingScores, genres=np.array(self.genres),
+                 genreOffsets=self.genreOffsets, genreMovieIds=self.genreMovieIds)
+        os.replace(tmpPath, path)
+
+    def popular(self, n):
+        return self.popularIds[:n].tolist()
+
+    def trending(self, n):
+        return self.trendingIds[:n].tolist()
+
+    def genre(self, genre, n):
+        # the genre's most popular movies; None for a genre the tables don't have
+        position = self._genrePositions.get(genre.lower())
+        if position is None:
+            return None
+        start, end = self.genreOffsets[position], self.genreOffsets[position + 1]
+        return self.genreMovieIds[start:min(end, start + n)].tolist()
+
+
+def popularity_path(csvPath):
+    # the tables are written next to the matrix csv they are served with
+    return os.path.splitext(csvPath)[0] + '_popularity.npz'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute popularity, trending and per-genre tables")
+    parser.add_argument('--ratings', default='ratings.csv')
+    parser.add_argument('--movies', default='movies.csv', help="movieId and genres of the catalog")
+    parser.add_argument('--matrix', default='centereduseritem_matrix.csv',
+                        help="matrix the tables are served next to")
+    parser.add_argument('--top', type=int, default=500, help="movies kept per ranking")
+    parser.add_argument('--prior-votes', type=float, default=None,
+                        help="ratings of prior weight in the Bayesian average (default: mean ratings per movie)")
+    parser.add_argument('--half-life-days', type=float, default=180.0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ratings = pd.read_csv(args.ratings, usecols=['userId', 'movieId', 'rating', 'timestamp'])
+    movies = pd.read_csv(args.movies, usecols=['movieId', 'genres']) if os.path.exists(args.movies) else None
+    tables = PopularityTables.build(ratings, movies, args.top, args.prior_votes, args.half_life_days)
+    tables.save(popularity_path(args.matrix))
+    print(f"popularity tables of {len(tables.popularIds)} movies, {len(tables.genres)} genres "
+          f"built in {time.perf_counter() - start:.2f}s")
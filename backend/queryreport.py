@@ -0,0 +1,114 @@
+import argparse
+import random
+import time
+
+import pandas as pd
+from sqlalchemy import inspect, select, text
+
+from db import Base, User, Movie, Rating, create_engine, rated_movies_query, user_ratings_query, movies_query
+from migrate import migrate
+
+# Query plans and latencies of the hot endpoint queries against a database
+# seeded from ratings.csv (100k ratings), without and then with the indexes
+# migrate.py adds. Repeatable: the database is rebuilt on every run. That drops
+# every table, so a database other than the report's own that already has
+# ratings is refused unless --force is given.
+#   python queryreport.py [--database-url postgresql://...] [--force]
+
+DEFAULT_DATABASE_URL = 'sqlite:///queryreport.db'
+
+
+def legacy_rated_movies_query(email):
+    # /rated-movies before it filtered by the user: User joined on a constant, then distinct
+    return select(Movie.id, Movie.name, Movie.description, Rating.rating).select_from(Rating).\
+        join(User, Rating.userEmail == email).join(Movie, Movie.id == Rating.movieId).distinct()
+
+
+def seed(engine, ratingsPath, moviesPath, force=False):
+    if not force and has_ratings(engine):
+        raise RuntimeError("the database already has ratings, "
+                           "rebuilding it would drop them; pass --force to rebuild it anyway")
+    ratings = pd.read_csv(ratingsPath, usecols=['userId', 'movieId', 'rating'])
+    titles = pd.read_csv(moviesPath, usecols=['movieId', 'title']).set_index('movieId')['title']
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    movieIds = sorted(ratings['movieId'].unique())
+    with engine.begin() as connection:
+        connection.execute(Movie.__table__.insert(), [
+            {"id": int(movieId), "name": titles.get(movieId, f"Movie {movieId}"), "description": "", "imageUrl": ""}
+            for movieId in movieIds])
+        connection.execute(User.__table__.insert(), [{"email": user_email(userId)}
+                                                    for userId in ratings['userId'].unique()])
+        connection.execute(Rating.__table__.insert(), [
+            {"userEmail": user_email(userId), "movieId": int(movieId), "rating": int(round(rating))}
+            for userId, movieId, rating in ratings.itertuples(index=False)])
+        # start from the schema as it was before the indexes
+        connection.execute(text("DROP INDEX uq_ratings_user_movie"))
+    return ratings
+
+
+def has_ratings(engine):
+    if not inspect(engine).has_table(Rating.__tablename__):
+        return False
+    with engine.connect() as connection:
+        return connection.execute(select(Rating.id).limit(1)).first() is not None
+
+
+def user_email(userId):
+    return f"user{userId}@movielens.example"
+
+
+def explain(engine, statement):
+    sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == 'sqlite' else "EXPLAIN ANALYZE "
+    with engine.connect() as connection:
+        rows = connection.execute(text(prefix + sql)).all()
+    return [row[-1] for row in rows]
+
+
+def latency(engine, statements):
+    timings = []
+    with engine.connect() as connection:
+        for statement in statements:
+            start = time.perf_counter()
+            connection.execute(statement).all()
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.95)] * 1000
+
+
+def report(engine, ratings, repeat):
+    rng = random.Random(0)
+    emails = [user_email(userId) for userId in rng.choices(list(ratings['userId'].unique()), k=repeat)]
+    movieIds = [[int(movieId) for movieId in rng.sample(list(ratings['movieId'].unique()), 7)] for _ in range(repeat)]
+    queries = [
+        ("/rated-movies, old join", [legacy_rated_movies_query(email) for email in emails]),
+        ("/rated-movies", [rated_movies_query(email) for email in emails]),
+        ("user's ratings for the recommender", [user_ratings_query([email]) for email in emails]),
+        ("/all-movies recommended rows", [movies_query(ids) for ids in movieIds]),
+    ]
+    for name, statements in queries:
+        p50, p95 = latency(engine, statements)
+        print(f"  {name}: p50 {p50:.2f}ms  p95 {p95:.2f}ms")
+        for line in explain(engine, statements[0]):
+            print(f"      {line}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN and latency report of the hot endpoint queries")
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL)
+    parser.add_argument('--ratings', default='ratings.csv')
+    parser.add_argument('--movies', default='movies.csv')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--force', action='store_true', help="rebuild the database even if it already has ratings")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    # the report's own database is rebuilt on every run
+    ratings = seed(engine, args.ratings, args.movies, force=args.force or args.database_url == DEFAULT_DATABASE_URL)
+    print(f"{len(ratings)} ratings, {ratings['userId'].nunique()} users, {ratings['movieId'].nunique()} movies")
+    print("without indexes:")
+    report(engine, ratings, args.repeat)
+    migrate(engine)
+    print("after migrate.py:")
+    report(engine, ratings, args.repeat)
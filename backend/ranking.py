@@ -0,0 +1,38 @@
+import numpy as np
+
+# Partial top-k selection shared by neighbor search and the recommendation engines.
+
+
+def top_k(scores, k):
+    # positions of the k highest scores, best first, in O(n + k log k).
+    # Ties are broken by position, the same order a stable full sort gives.
+    # Scores must not contain NaN; use -inf for entries that should rank last.
+    scores = np.asarray(scores)
+    k = max(min(k, len(scores)), 0)
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def top_k_rows(scores, k):
+    # top_k of every row of a 2D array in one pass, as a list of position arrays;
+    # -inf entries are left out, so a row can have fewer than k positions
+    scores = np.asarray(scores)
+    numRows, numCols = scores.shape
+    k = max(min(k, numCols), 0)
+    if k == 0:
+        return [np.zeros(0, dtype=np.int64) for _ in range(numRows)]
+    kth = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+    rows, cols = np.nonzero((scores >= kth[:, None]) & np.isfinite(scores))
+    values = scores[rows, cols]
+    order = np.lexsort((cols, -values, rows))
+    rows, cols = rows[order], cols[order]
+    starts = np.searchsorted(rows, np.arange(numRows + 1))
+    return [cols[start:min(end, start + k)] for start, end in zip(starts[:-1], starts[1:])]
@@ -0,0 +1,342 @@
+import copy
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Sparse user-item matrix used by the recommender.
+# Rows are users, columns are movies, stored values are the (centered) ratings.
+# A stored 0.0 is a real rating equal to the user's mean, so "not rated" is
+# told apart by the sparsity structure and never by the value.
+# Ratings written after loading (set_rating) live in per-user row overrides on
+# top of the base CSR/CSC, which may be a read-only memory map; compact()
+# folds them back into the base matrices.
+# Writes are copy-on-write: new id arrays, means, overrides and base matrices
+# are built aside and published together under the matrix's lock, and arrays
+# already published are never changed in place. Readers that may run alongside
+# writers score against snapshot(), a view that keeps seeing one version.
+
+# Binary artifact layout: magic, little-endian uint64 header length, a JSON
+# header naming each array's dtype, shape and offset, then the raw arrays
+# aligned to ARTIFACT_ALIGNMENT bytes so they can be memory-mapped in place.
+ARTIFACT_MAGIC = b'MMRATE01'
+ARTIFACT_ALIGNMENT = 64
+
+
+class RatingsMatrix:
+
+    def __init__(self, csr, userIds, movieIds, userMeans=None, csc=None):
+        if csc is None:
+            self.csr = sparse.csr_matrix(csr)
+            self.csr.sort_indices()
+            # column-major copy for fast "every user's ratings of these movies" slices
+            self.csc = self.csr.tocsc()
+        else:
+            # both layouts given (e.g. memory-mapped from an artifact), use them as is
+            self.csr = csr
+            self.csc = csc
+        self.userIds = np.asarray(userIds)
+        self.movieIds = np.asarray(movieIds)
+        self.userMeans = None if userMeans is None else np.asarray(userMeans, dtype=float)
+        self._userPositions = pd.Index(self.userIds)
+        self._moviePositions = pd.Index(self.movieIds)
+        # userIdx -> (sorted column positions, centered ratings) replacing the base row
+        self._rowOverrides = {}
+        # bumped by every write; a snapshot keeps the version it was taken at
+        self.version = 0
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def __getstate__(self):
+        # locks don't pickle (e.g. to a process pool) or copy; the copy gets its own
+        state = dict(self.__dict__)
+        del state['_lock'], state['_snapshot']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    @classmethod
+    def from_dataframe(cls, frame):
+        # frame is the dense users x movies layout written by ratingspreprocess.py
+        values = frame.to_numpy(dtype=float)
+        rows, cols = np.nonzero(~np.isnan(values))
+        csr = sparse.csr_matrix((values[rows, cols], (rows, cols)), shape=values.shape)
+        return cls(csr, frame.index.to_numpy(), frame.columns.astype(int).to_numpy())
+
+    @classmethod
+    def from_ratings(cls, ratings, meansById=None):
+        # ratings is the long userId, movieId, rating table (a DataFrame or a dict
+        # of arrays); values are mean-centered here. meansById, when given, holds
+        # precomputed per-user means indexed by the raw user id.
+        userIds, rows = np.unique(np.asarray(ratings['userId']), return_inverse=True)
+        movieIds, cols = np.unique(np.asarray(ratings['movieId']), return_inverse=True)
+        values = np.asarray(ratings['rating'], dtype=float)
+        if meansById is None:
+            userMeans = np.bincount(rows, weights=values) / np.bincount(rows)
+        else:
+            userMeans = np.asarray(meansById, dtype=float)[userIds]
+        csr = sparse.csr_matrix((values - userMeans[rows], (rows, cols)),
+                                shape=(len(userIds), len(movieIds)))
+        return cls(csr, userIds, movieIds, userMeans)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # open a binary artifact written by save(); with mmap the arrays stay
+        # backed by the file and are shared between processes by the page cache
+        with open(path, 'rb') as f:
+            if f.read(len(ARTIFACT_MAGIC)) != ARTIFACT_MAGIC:
+                raise ValueError(f"{path} is not a ratings matrix artifact")
+            headerLength = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            header = json.loads(f.read(headerLength))
+
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            if 0 in spec['shape']:
+                # an empty region can't be mapped
+                arrays[name] = np.empty(spec['shape'], dtype=spec['dtype'])
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r',
+                                         offset=spec['offset'], shape=tuple(spec['shape']))
+            else:
+                arrays[name] = np.fromfile(path, dtype=spec['dtype'], offset=spec['offset'],
+                                           count=int(np.prod(spec['shape'])))
+
+        shape = tuple(header['shape'])
+        csr = sparse.csr_matrix((arrays['csr_data'], arrays['csr_indices'], arrays['csr_indptr']),
+                                shape=shape, copy=False)
+        csc = sparse.csc_matrix((arrays['csc_data'], arrays['csc_indices'], arrays['csc_indptr']),
+                                shape=shape, copy=False)
+        csr.has_sorted_indices = True
+        csc.has_sorted_indices = True
+        return cls(csr, arrays['userIds'], arrays['movieIds'], arrays.get('userMeans'), csc=csc)
+
+    def save(self, path):
+        self.compact()
+        arrays = {
+            'csr_data': self.csr.data, 'csr_indices': self.csr.indices, 'csr_indptr': self.csr.indptr,
+            'csc_data': self.csc.data, 'csc_indices': self.csc.indices, 'csc_indptr': self.csc.indptr,
+            'userIds': self.userIds, 'movieIds': self.movieIds,
+        }
+        if self.userMeans is not None:
+            arrays['userMeans'] = self.userMeans
+        arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+        # lay out the arrays first so the header can record their offsets;
+        # the header is padded to a fixed size so its length doesn't move them
+        specs = {name: {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': 0}
+                 for name, array in arrays.items()}
+        headerSize = len(json.dumps({'shape': list(self.shape), 'arrays': specs})) + 32 * len(specs)
+        offset = _align(len(ARTIFACT_MAGIC) + 8 + headerSize)
+        for name, array in arrays.items():
+            specs[name]['offset'] = offset
+            offset = _align(offset + array.nbytes)
+        header = json.dumps({'shape': list(self.shape), 'arrays': specs}).encode().ljust(headerSize)
+
+        # write next to the target and rename, so readers never map a half-written file
+        tmpPath = f"{path}.tmp"
+        with open(tmpPath, 'wb') as f:
+            f.write(ARTIFACT_MAGIC)
+            f.write(np.array([headerSize], dtype='<u8').tobytes())
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(specs[name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(offset)
+        os.replace(tmpPath, path)
+
+    @property
+    def shape(self):
+        return len(self.userIds), len(self.movieIds)
+
+    def snapshot(self):
+        # a read-only view of the current version, shared by the readers until the
+        # next write; it shares every array with the matrix, so it costs O(1)
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = copy.copy(self)
+            return self._snapshot
+
+    def has_user(self, userId):
+        return userId in self._userPositions
+
+    def user_index(self, userId):
+        return self._userPositions.get_loc(userId)
+
+    def user_indexer(self, userIds):
+        return self._userPositions.get_indexer(userIds)
+
+    def movie_indexer(self, movieIds):
+        # column positions of the movie ids, -1 for movies not in the matrix
+        return self._moviePositions.get_indexer(movieIds)
+
+    def user_row(self, userIdx):
+        # (column positions, ratings) of the movies the user rated
+        if userIdx in self._rowOverrides:
+            return self._rowOverrides[userIdx]
+        if userIdx >= self.csr.shape[0]:
+            return np.zeros(0, dtype=self.csr.indices.dtype), np.zeros(0)
+        start, end = self.csr.indptr[userIdx], self.csr.indptr[userIdx + 1]
+        return self.csr.indices[start:end], self.csr.data[start:end]
+
+    def column_block(self, cols):
+        # every user's ratings of the given columns as a sparse users x len(cols)
+        # CSR matrix; O(ratings in those columns), never users x columns
+        cols = np.asarray(cols)
+        inBase = np.flatnonzero(cols < self.csc.shape[1])
+        base = self.csc[:, cols[inBase]].tocoo()
+        rows, positions, values = [base.row], [inBase[base.col]], [base.data]
+        if self._rowOverrides:
+            keep = ~np.isin(base.row, list(self._rowOverrides))
+            rows, positions, values = [base.row[keep]], [positions[0][keep]], [base.data[keep]]
+            columnPositions = self._column_positions(cols)
+            for userIdx, (rowCols, rowValues) in self._rowOverrides.items():
+                found = columnPositions[rowCols] >= 0
+                rows.append(np.full(found.sum(), userIdx))
+                positions.append(columnPositions[rowCols[found]])
+                values.append(rowValues[found])
+        return sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(positions))),
+                                 shape=(self.shape[0], len(cols)))
+
+    def dense_rows(self, rows, cols):
+        # ratings of the given users for the given columns, NaN where unrated
+        positions = self._column_positions(cols)
+        dense = np.full((len(rows), len(cols)), np.nan)
+        for i, userIdx in enumerate(rows):
+            rowCols, rowValues = self.user_row(userIdx)
+            found = positions[rowCols] >= 0
+            dense[i, positions[rowCols[found]]] = rowValues[found]
+        return dense
+
+    def _column_positions(self, cols):
+        # lookup table from column index to its position in cols, -1 if absent
+        positions = np.full(self.shape[1], -1)
+        positions[cols] = np.arange(len(cols))
+        return positions
+
+    def set_rating(self, userId, movieId, rating):
+        return self.set_ratings(userId, [(movieId, rating)])
+
+    def set_ratings(self, userId, ratings, replace=False):
+        # Store raw (movieId, rating) pairs of one user and re-center that user's row
+        # around its new mean; with replace they become the user's only ratings. Costs
+        # O(user's ratings + users), plus O(movies) when a movie is new. Returns the
+        # user's row index.
+        with self._lock:
+            userIds, userPositions, userMeans = self.userIds, self._userPositions, self.userMeans
+            if userId not in userPositions:
+                userIds = np.append(userIds, userId)
+                userPositions = pd.Index(userIds)
+                if userMeans is not None:
+                    userMeans = np.append(userMeans, np.nan)
+            movieIds, moviePositions = self.movieIds, self._moviePositions
+            newMovies = [movieId for movieId in dict(ratings) if movieId not in moviePositions]
+            if newMovies:
+                movieIds = np.append(movieIds, newMovies)
+                moviePositions = pd.Index(movieIds)
+            # means of a matrix loaded from the centered csv are unknown; memory-mapped
+            # means are read-only, and published ones are never written, so always copy
+            userMeans = np.full(len(userIds), np.nan) if userMeans is None else np.array(userMeans, dtype=float)
+            userIdx = userPositions.get_loc(userId)
+
+            cols, values = self.user_row(userIdx) if not replace else (np.zeros(0, dtype=int), np.zeros(0))
+            mean = userMeans[userIdx]
+            if len(cols) > 0 and np.isnan(mean):
+                raise ValueError(f"user {userId} has no stored mean, rebuild the matrix with ratingspreprocess.py")
+            raw = dict(zip(cols.tolist(), (np.asarray(values, dtype=float) + (mean if len(cols) > 0 else 0.0)).tolist()))
+            for movieId, rating in ratings:
+                raw[moviePositions.get_loc(movieId)] = float(rating)
+            cols = np.array(sorted(raw), dtype=self.csr.indices.dtype)
+            raw = np.array([raw[col] for col in cols.tolist()])
+
+            newMean = raw.mean()
+            userMeans[userIdx] = newMean
+            rowOverrides = dict(self._rowOverrides)
+            rowOverrides[userIdx] = (cols, raw - newMean)
+            self.userIds, self._userPositions, self.userMeans = userIds, userPositions, userMeans
+            self.movieIds, self._moviePositions = movieIds, moviePositions
+            self._rowOverrides = rowOverrides
+            self._published()
+            return userIdx
+
+    def _published(self):
+        self.version += 1
+        self._snapshot = None
+
+    def compact(self):
+        # fold the row overrides and any new users or movies into new base matrices
+        with self._lock:
+            rowOverrides = self._rowOverrides
+            if not rowOverrides and self.csr.shape == self.shape:
+                return
+            coo = self.csr.tocoo()
+            keep = ~np.isin(coo.row, list(rowOverrides))
+            rows, cols, values = [coo.row[keep]], [coo.col[keep]], [coo.data[keep]]
+            for userIdx, (rowCols, rowValues) in rowOverrides.items():
+                rows.append(np.full(len(rowCols), userIdx))
+                cols.append(rowCols)
+                values.append(rowValues)
+            csr = sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                                    shape=self.shape)
+            csr.sort_indices()
+            self.csr, self.csc, self._rowOverrides = csr, csr.tocsc(), {}
+            self._published()
+
+    def to_dataframe(self):
+        self.compact()
+        dense = np.full(self.shape, np.nan)
+        coo = self.csr.tocoo()
+        dense[coo.row, coo.col] = coo.data
+        return pd.DataFrame(dense, index=pd.Index(self.userIds, name='userId'), columns=self.movieIds)
+
+    def memory_usage(self):
+        # bytes held by the CSR and CSC copies plus the id arrays
+        total = self.userIds.nbytes + self.movieIds.nbytes
+        for matrix in (self.csr, self.csc):
+            total += matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+        if self.userMeans is not None:
+            total += self.userMeans.nbytes
+        for rowCols, rowValues in self._rowOverrides.values():
+            total += rowCols.nbytes + rowValues.nbytes
+        return total
+
+
+def _align(offset):
+    return -(-offset // ARTIFACT_ALIGNMENT) * ARTIFACT_ALIGNMENT
+
+
+def artifact_path(csvPath):
+    # the binary artifact is written next to the csv with a .bin extension
+    return os.path.splitext(csvPath)[0] + '.bin'
+
+
+def load_ratings_matrix(csvPath):
+    # prefer the memory-mapped binary artifact, fall back to parsing the csv
+    binPath = artifact_path(csvPath)
+    if os.path.exists(binPath):
+        return RatingsMatrix.load(binPath)
+    return RatingsMatrix.from_dataframe(pd.read_csv(csvPath, index_col=0))
+
+
+def compare_memory(ratingsPath):
+    # memory of the dense pandas pivot against the sparse matrix for the same ratings
+    ratings = pd.read_csv(ratingsPath)
+    dense = ratings.pivot_table(index='userId', columns='movieId', values='rating')
+    matrix = RatingsMatrix.from_ratings(ratings)
+    denseBytes = dense.memory_usage(deep=True).sum()
+    sparseBytes = matrix.memory_usage()
+    density = matrix.csr.nnz / (matrix.shape[0] * matrix.shape[1])
+    print(f"{matrix.shape[0]} users x {matrix.shape[1]} movies, {matrix.csr.nnz} ratings ({density:.2%} filled)")
+    print(f"dense pandas matrix: {denseBytes / 2**20:.1f} MiB")
+    print(f"sparse CSR + CSC:    {sparseBytes / 2**20:.1f} MiB")
+    return denseBytes, sparseBytes
+
+
+if __name__ == "__main__":
+    compare_memory(sys.argv[1] if len(sys.argv) > 1 else 'ratings.csv')
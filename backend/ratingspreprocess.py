@@ -1,13 +1,76 @@
+import argparse
+import tracemalloc
+
+import numpy as np
 import pandas as pd
+from ratingsmatrix import RatingsMatrix, artifact_path
+
+RATINGS_DTYPES = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32}
+
+
+def preprocess(inputFilePath, outputFilePath):
+    df = pd.read_csv(inputFilePath)
+    df.drop('timestamp', axis=1, inplace=True)
+
+    UserItemMatrix = df.pivot_table(index='userId', columns='movieId', values='rating')
+    UserMeanRatings = UserItemMatrix.mean(axis = 1)
+    CenteredUserItemMatrix = UserItemMatrix.sub(UserMeanRatings, axis=0)
+
+    CenteredUserItemMatrix.to_csv(outputFilePath)
+
+    # binary artifact the recommender memory-maps instead of parsing the csv
+    RatingsMatrix.from_ratings(df).save(artifact_path(outputFilePath))
+
+
+def preprocess_streaming(inputFilePath, outputFilePath, chunksize=1_000_000):
+    # Read the ratings in bounded chunks with small dtypes and never build the
+    # dense pivot: only the ratings themselves (10 bytes each) and the per-user
+    # sums are kept, and only the sparse binary artifact is written.
+    userChunks, movieChunks, ratingChunks = [], [], []
+    sums = np.zeros(0)
+    counts = np.zeros(0, dtype=np.int64)
+    for chunk in pd.read_csv(inputFilePath, usecols=list(RATINGS_DTYPES), dtype=RATINGS_DTYPES,
+                             chunksize=chunksize):
+        users = chunk['userId'].to_numpy()
+        ratings = chunk['rating'].to_numpy()
+        size = max(len(sums), int(users.max()) + 1)
+        sums = np.pad(sums, (0, size - len(sums))) + np.bincount(users, weights=ratings, minlength=size)
+        counts = np.pad(counts, (0, size - len(counts))) + np.bincount(users, minlength=size)
+        userChunks.append(users)
+        movieChunks.append(chunk['movieId'].to_numpy())
+        ratingChunks.append(ratings)
+
+    userIds = np.concatenate(userChunks)
+    del userChunks
+    movieIds = np.concatenate(movieChunks)
+    del movieChunks
+    ratings = np.concatenate(ratingChunks)
+    del ratingChunks
+
+    # per-user means from the running sums, applied while building the matrix
+    means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    matrix = RatingsMatrix.from_ratings({'userId': userIds, 'movieId': movieIds, 'rating': ratings},
+                                        meansById=means)
+    matrix.save(artifact_path(outputFilePath))
+    return matrix
 
-df = pd.read_csv('ratings.csv')
-df.drop('timestamp', axis=1, inplace=True)
 
-UserItemMatrix = df.pivot_table(index='userId', columns='movieId', values='rating')
-UserMeanRatings = UserItemMatrix.mean(axis = 1)
-CenteredUserItemMatrix = UserItemMatrix.sub(UserMeanRatings, axis=0)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Center ratings.csv into the user-item matrix")
+    parser.add_argument('--input', default='ratings.csv')
+    parser.add_argument('--output', default='centereduseritem_matrix.csv')
+    parser.add_argument('--stream', action='store_true',
+                        help="read in chunks and write only the binary artifact")
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    args = parser.parse_args()
 
-outputFilePath = "centereduseritem_matrix.csv"
-CenteredUserItemMatrix.to_csv(outputFilePath)
+    tracemalloc.start()
+    if args.stream:
+        preprocess_streaming(args.input, args.output, args.chunksize)
+    else:
+        preprocess(args.input, args.output)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
 
-print("file exported")
\ No newline at end of file
+    print("file exported")
+    print(f"peak memory: {peak / 2**20:.1f} MiB")
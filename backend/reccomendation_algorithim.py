@@ -1,25 +1,83 @@
 import pandas as pd 
 from scipy.stats import pearsonr
 import numpy as np
+import os
+import re
+import threading
+import time
+from modelregistry import ModelRegistry
+from neighborindex import NeighborIndex, top_neighbors, predict_from_neighbors
+from itemsimilarity import ItemSimilarityIndex
+from matrixfactorization import MatrixFactorization
+from contentsimilarity import GenreBitsets
+from ranking import top_k
 
-#read in the preprocessed data
-UserItemMatrix = pd.read_csv('testcentereduseritem_matrix.csv', index_col=0)
-movies_df = pd.read_csv('movies_encoded.csv')
+MATRIX_PATH = os.getenv('RECOMMENDER_MATRIX', 'testcentereduseritem_matrix.csv')
+NEIGHBOR_INDEX_K = 20
+#genre flags of the catalog (moviespreprocess.py) for content-based similarity, and the number
+#of ratings below which a user is recommended by content instead of collaborative filtering
+MOVIES_PATH = os.getenv('RECOMMENDER_MOVIES', 'movies_encoded.csv')
+CONTENT_METRIC = os.getenv('CONTENT_SIMILARITY', 'jaccard')
+MIN_CF_RATINGS = int(os.getenv('MIN_CF_RATINGS', '5'))
 
-def pearson_correlation(user1, user2):
-    user1_ratings = UserItemMatrix.loc[user1]
-    user2_ratings = UserItemMatrix.loc[user2]
+#the preprocessed ratings matrix and the artifacts built from it are loaded on first
+#use (or by load_models at startup), not at import; Registry.reload swaps in a new version
+Registry = ModelRegistry(MATRIX_PATH)
+#writers (ratings from the app, neighbor index swaps) take _update_lock; readers score
+#against a snapshot of the ratings, which new ratings never change (see ratingsmatrix.py)
+_update_lock = threading.Lock()
+#models built on first use (item similarities, factors) are built by one thread, the others wait
+_build_lock = threading.Lock()
 
-    #print(user1_ratings.index)
-    #print(user1_ratings)
-    
-    #print(user2_ratings.index)
-    #print(user2_ratings)
+#recommender user ids handed out to app users (by email); an email keeps its id across
+#model reloads, and ids are never reused
+AppUserIds = {}
+_newUserIds = set()
+
+#users seed-db.py created for the MovieLens ratings are recommended from their own matrix row
+MOVIELENS_EMAIL_TEMPLATE = os.getenv('MOVIELENS_EMAIL_TEMPLATE', 'movielens{userId}@moviemate.local')
+_MOVIELENS_EMAIL = re.compile(re.escape(MOVIELENS_EMAIL_TEMPLATE).replace(re.escape('{userId}'), r'(\d+)'))
+
+#the current models under their old module-level names, e.g. reccomendation_algorithim.Ratings
+_MODEL_ATTRIBUTES = {'Ratings': 'ratings', 'Similarities': 'similarities', 'Neighbors': 'neighbors',
+                     'ItemSimilarities': 'itemSimilarities', 'Factors': 'factors',
+                     'ChangedUsers': 'changedUsers'}
+
+def __getattr__(name):
+    if name in _MODEL_ATTRIBUTES:
+        return getattr(Registry.get(), _MODEL_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def load_models(warmUpEngine = None):
+    # load the models now instead of on the first request; with warmUpEngine the
+    # engine's lazily built parts are built and one recommendation is scored
+    models = Registry.get()
+    popular_movies()
+    if warmUpEngine is not None and models.ratings.shape[0] > 0:
+        RECOMMENDERS[warmUpEngine](models.ratings.userIds[0], 1)
+    return models
 
+def reload_models(matrixPath = None):
+    # swap in freshly loaded artifacts, e.g. after the preprocessing and build
+    # scripts wrote a new version; app users are loaded again on their next request
+    return Registry.reload(matrixPath)
+
+def current_ratings():
+    # the ratings as of now, unchanged by ratings written while the caller scores them
+    return Registry.get().ratings.snapshot()
+
+def user_ratings(userId):
+    # the movies a user rated, as a Series indexed by movie id
+    ratings = current_ratings()
+    cols, values = ratings.user_row(ratings.user_index(userId))
+    return pd.Series(values, index=ratings.movieIds[cols])
+
+def pearson_correlation(user1, user2):
+    user1_ratings = user_ratings(user1)
+    user2_ratings = user_ratings(user2)
 
     # Filter to keep only movies rated by both users
-    common_movies = user1_ratings.notna() & user2_ratings.notna()
-    #print(common_movies) #debug print statement
+    common_movies = user1_ratings.index.intersection(user2_ratings.index)
     user1_common_ratings = user1_ratings[common_movies]
     #print(user1_common_ratings)#debug print statement
     user2_common_ratings = user2_ratings[common_movies]
@@ -35,38 +93,279 @@ def pearson_correlation(user1, user2):
     
 
 def find_nearest_neighbor(userID, numNeighbors = 5):
-    correlations = []
-    for otherUser in UserItemMatrix.index:
-        if userID != otherUser:
-            corr = pearson_correlation(userID, otherUser)
-            correlations.append((otherUser, corr))
-    correlations.sort(key=lambda x: x[1], reverse=True)
-    return correlations[:numNeighbors]
+    return nearest_neighbors(current_ratings(), userID, numNeighbors)
+
+def nearest_neighbors(ratings, userID, numNeighbors = 5):
+    # find_nearest_neighbor on a snapshot of the ratings
+    models = Registry.get()
+    userIdx = ratings.user_index(userID)
+    index = models.neighbors
+    if index is not None and numNeighbors <= index.k and index.has_user(userID) and userID not in models.changedUsers:
+        return list(zip(*index.neighbors(userID, numNeighbors)))
+    order, similarities = top_neighbors(models.similarities.get(userIdx, ratings), userIdx, numNeighbors)
+    return list(zip(ratings.userIds[order], similarities))
     
 
+def predicted_scores(userId, movieIds, numNeighbors = 5, ratings = None):
+    # find the neighbors once and score every requested movie against them;
+    # an array with NaN where there is no prediction. The neighbors' ratings are
+    # centered, so the user's mean is added back when the matrix knows it (a matrix
+    # loaded from the centered csv doesn't, its predictions stay centered)
+    ratings = ratings if ratings is not None else current_ratings()
+    predictions = np.full(len(movieIds), np.nan)
+    if not ratings.has_user(userId):
+        return predictions
+    movieIdxs = ratings.movie_indexer(movieIds)
+    known = movieIdxs >= 0
+    neighbors = nearest_neighbors(ratings, userId, numNeighbors)
+    if len(neighbors) == 0 or not known.any():
+        return predictions
+
+    neighborIdxs = ratings.user_indexer([neighbor_id for neighbor_id, _ in neighbors])
+    similarities = np.array([similarity for _, similarity in neighbors], dtype=float)
+    predictions[known] = predict_from_neighbors(ratings, neighborIdxs, similarities, movieIdxs[known])
+    if ratings.userMeans is not None and not np.isnan(ratings.userMeans[ratings.user_index(userId)]):
+        predictions += ratings.userMeans[ratings.user_index(userId)]
+    return predictions
+
+def predict_ratings(userId, movieIds, numNeighbors = 5):
+    return [None if np.isnan(p) else float(p) for p in predicted_scores(userId, movieIds, numNeighbors)]
+
 def predict_rating(userId, movieId, numNeighbors = 5):
-    if userId not in UserItemMatrix.index:
-        return None
-    neighbors = find_nearest_neighbor(userId, numNeighbors)
-    num = den = 0
-    for neighbor_id, similarity in neighbors:
-        neighbor_rating = UserItemMatrix.loc[neighbor_id]
-        if pd.notna(neighbor_rating[movieId]):
-            num += similarity * neighbor_rating[movieId]
-            den += abs(similarity)
-    return num/den if den != 0 else None
+    return predict_ratings(userId, [movieId], numNeighbors)[0]
+
+def rank_movies(movieIds, scores, numReccomendations):
+    # the best numReccomendations (movieId, score) pairs, best first, skipping unscored (NaN) movies
+    scores = np.where(np.isnan(scores), -np.inf, scores)
+    top = top_k(scores, numReccomendations)
+    top = top[np.isfinite(scores[top])]
+    return list(zip(movieIds[top].tolist(), scores[top].tolist()))
+
+def rank_user_based(userId, numReccomendations = 5):
+    ratings = current_ratings()
+    rated_cols, _ = ratings.user_row(ratings.user_index(userId))
+    unrated = np.ones(ratings.shape[1], dtype=bool)
+    unrated[rated_cols] = False
+    unrated_movies = ratings.movieIds[unrated]
+    return rank_movies(unrated_movies, predicted_scores(userId, unrated_movies, ratings=ratings), numReccomendations)
+
+def item_similarity_index():
+    models = Registry.get()
+    if models.itemSimilarities is None:
+        with _build_lock:
+            if models.itemSimilarities is None:
+                models.itemSimilarities = ItemSimilarityIndex.build(compact_ratings())
+    return models.itemSimilarities
+
+def rank_item_based(userId, numReccomendations = 5):
+    # item-based CF: score unrated movies only from the movies the user rated
+    ratings = current_ratings()
+    index = item_similarity_index()
+    rated_cols, rated_values = ratings.user_row(ratings.user_index(userId))
+    scores = index.score(rated_cols, rated_values)
+    scores[rated_cols[rated_cols < len(scores)]] = np.nan
+    return rank_movies(index.movieIds, scores, numReccomendations)
+
+def matrix_factorization_model():
+    models = Registry.get()
+    if models.factors is None:
+        with _build_lock:
+            if models.factors is None:
+                models.factors = MatrixFactorization.train(compact_ratings())
+    return models.factors
+
+def rank_matrix_factorization(userId, numReccomendations = 5):
+    # one vector-matrix product against the item factors
+    models = Registry.get()
+    ratings = current_ratings()
+    model = matrix_factorization_model()
+    rated_cols, rated_values = ratings.user_row(ratings.user_index(userId))
+    rated_idxs = model.movie_indexer(ratings.movieIds[rated_cols])
+    if model.has_user(userId) and userId not in models.changedUsers:
+        user_vector = model.user_vector(userId)
+    else:
+        user_vector = model.fold_in(rated_idxs, rated_values)
+    scores = model.scores(user_vector).astype(float)
+    scores[rated_idxs[rated_idxs >= 0]] = np.nan
+    return rank_movies(model.movieIds, scores, numReccomendations)
+
+def content_index():
+    # the genre bitsets of the catalog, loaded on first use; None without movies_encoded.csv
+    models = Registry.get()
+    if models.contentSimilarity is None and os.path.exists(MOVIES_PATH):
+        models.contentSimilarity = GenreBitsets.load(MOVIES_PATH, CONTENT_METRIC)
+    return models.contentSimilarity
+
+def similar_movies(movieId, numReccomendations = 10):
+    # "more like this": (movieId, similarity) pairs, None if the movie isn't in the catalog
+    index = content_index()
+    return None if index is None else index.similar_movies(movieId, numReccomendations)
+
+def rank_content_based(userId, numReccomendations = 5):
+    # movies similar to the ones the user liked (above their mean rating), or to all
+    # they rated when none stands out, e.g. with a single rating
+    ratings = current_ratings()
+    index = content_index()
+    if index is None:
+        return []
+    rated_cols, rated_values = ratings.user_row(ratings.user_index(userId))
+    weights = np.maximum(rated_values, 0)
+    if weights.sum() <= 0:
+        weights = np.ones(len(rated_cols))
+    scores = index.score(ratings.movieIds[rated_cols], weights)
+    scores[scores <= 0] = np.nan
+    return rank_movies(index.movieIds, scores, numReccomendations)
 
 def reccomend_movies(userId, numReccomendations = 5):
-    user_ratings = UserItemMatrix.loc[userId]
-    unrated_movies = user_ratings[user_ratings.isna()].index
-    predicted_ratings = [(movie_id, predict_rating(userId, movie_id)) for movie_id in unrated_movies]
-    valid_predicted_ratings = [rating for rating in predicted_ratings if rating[1] is not None]
-    valid_predicted_ratings.sort(key=lambda x: x[1], reverse=True)
-    reccomend_movie_ids = [movie_id for movie_id,  _ in predicted_ratings[:numReccomendations]]
-    recommended_movies_dict = {userId: reccomend_movie_ids}
-    return recommended_movies_dict
-
-
-recommended_movies = reccomend_movies(1,7)
-print("Recommended Movies:")
-print(recommended_movies)
\ No newline at end of file
+    ranked = rank_user_based(userId, numReccomendations)
+    return {userId: [movie_id for movie_id, _ in ranked]}
+
+def reccomend_movies_item_based(userId, numReccomendations = 5):
+    ranked = rank_item_based(userId, numReccomendations)
+    return {userId: [movie_id for movie_id, _ in ranked]}
+
+def reccomend_movies_matrix_factorization(userId, numReccomendations = 5):
+    ranked = rank_matrix_factorization(userId, numReccomendations)
+    return {userId: [movie_id for movie_id, _ in ranked]}
+
+def reccomend_movies_content_based(userId, numReccomendations = 5):
+    ranked = rank_content_based(userId, numReccomendations)
+    return {userId: [movie_id for movie_id, _ in ranked]}
+
+def popular_movies(numReccomendations = 5):
+    # the cold-start list and the cheap fallback when a personal recommendation can't be
+    # made in time: the precomputed Bayesian-average ranking, or without it the most rated
+    # movies of the matrix, computed once per model version
+    models = Registry.get()
+    if models.popularity is not None:
+        return models.popularity.popular(numReccomendations)
+    if models.popularMovieIds is None:
+        ratings = models.ratings.snapshot()
+        counts = np.diff(ratings.csc.indptr)
+        models.popularMovieIds = ratings.movieIds[:len(counts)][top_k(counts, 100)].tolist()
+    return models.popularMovieIds[:numReccomendations]
+
+def trending_movies(numReccomendations = 5):
+    # highly rated recently, the popular movies when the tables weren't built
+    models = Registry.get()
+    if models.popularity is None:
+        return popular_movies(numReccomendations)
+    return models.popularity.trending(numReccomendations)
+
+def genre_movies(genre, numReccomendations = 5):
+    # the most popular movies of a genre; None for an unknown genre or without the tables
+    models = Registry.get()
+    if models.popularity is None:
+        return None
+    return models.popularity.genre(genre, numReccomendations)
+
+#recommendation engines selectable by name, e.g. through RECOMMENDER_ENGINE in main.py
+RECOMMENDERS = {'user': reccomend_movies, 'item': reccomend_movies_item_based,
+                'mf': reccomend_movies_matrix_factorization}
+
+def recommend(userId, numReccomendations = 5, engine = 'user'):
+    # movie ids from the engine, or first by content for users with fewer than MIN_CF_RATINGS
+    # ratings, whose neighbors and factors say little; each falls back to the other when it
+    # finds nothing, and both to the popular movies the user hasn't rated
+    ratings = current_ratings()
+    rated_cols, _ = ratings.user_row(ratings.user_index(userId))
+    engines = [RECOMMENDERS[engine], reccomend_movies_content_based]
+    if len(rated_cols) < MIN_CF_RATINGS:
+        engines.reverse()
+    for recommend_with in engines:
+        recommended = recommend_with(userId, numReccomendations)[userId]
+        if len(recommended) > 0:
+            return recommended
+    return popular_unrated_movies(ratings, userId, numReccomendations)
+
+def popular_unrated_movies(ratings, userId, numReccomendations = 5):
+    # popular_movies without the ones the user rated in ratings, a snapshot of the matrix
+    if not ratings.has_user(userId):
+        return popular_movies(numReccomendations)
+    rated_cols, _ = ratings.user_row(ratings.user_index(userId))
+    rated = set(ratings.movieIds[rated_cols].tolist())
+    popular = popular_movies(numReccomendations + len(rated))
+    return [movieId for movieId in popular if movieId not in rated][:numReccomendations]
+
+def movielens_user_id(email):
+    # the MovieLens user id in a seeded user's email, None for other emails
+    match = _MOVIELENS_EMAIL.fullmatch(email)
+    return None if match is None else int(match.group(1))
+
+def recommender_user_id(email, create=False):
+    # map an app user's email to their row in the recommender; None until the user's
+    # ratings are in the current models, create=True adds them (e.g. after a reload).
+    # The caller loads the user's stored ratings into the row it creates
+    models = Registry.get()
+    with _update_lock:
+        if email in models.appUsers:
+            return AppUserIds[email]
+        if not create:
+            return None
+        userId = movielens_user_id(email)
+        if userId is None or userId in _newUserIds or not models.ratings.has_user(userId):
+            # not a MovieLens user of this matrix: the id handed out to the email before, or a new one
+            userId = AppUserIds.get(email)
+            if userId not in _newUserIds or models.ratings.has_user(userId):
+                # new users, and users whose id was taken by a user of a newly loaded matrix
+                userId = int(max(models.ratings.userIds.max(), max(AppUserIds.values(), default=0))) + 1
+                _newUserIds.add(userId)
+        AppUserIds[email] = userId
+        models.appUsers.add(email)
+        return userId
+
+def update_user_rating(userId, movieId, rating):
+    # apply one new or changed rating without rebuilding the matrix: the user's
+    # row is re-centered and their cached similarities are refreshed
+    models = Registry.get()
+    with _update_lock:
+        userIdx = models.ratings.set_rating(userId, movieId, rating)
+        models.similarities.refresh_user(userIdx)
+        models.changedUsers.add(userId)
+
+def update_user_ratings(userId, ratings, replace = False):
+    # several (movieId, rating) pairs of one user, refreshing their similarities once;
+    # with replace they are all of the user's ratings, e.g. loaded from the database
+    if len(ratings) == 0:
+        return
+    models = Registry.get()
+    with _update_lock:
+        userIdx = models.ratings.set_ratings(userId, ratings, replace)
+        models.similarities.refresh_user(userIdx)
+        models.changedUsers.add(userId)
+
+def compact_ratings():
+    # fold the incremental updates into the base sparse matrices, for whole-matrix
+    # products such as batch scoring; snapshots taken before keep the old ones.
+    # Returns a snapshot of the compacted ratings
+    ratings = Registry.get().ratings
+    with _update_lock:
+        ratings.compact()
+        return ratings.snapshot()
+
+def rebuild_neighbor_index(k = NEIGHBOR_INDEX_K):
+    # build a fresh index from the current ratings and swap it in with a single
+    # assignment, so requests see either the old or the new index
+    models = Registry.get()
+    with _update_lock:
+        rebuilt_users = set(models.changedUsers)
+        ratings = models.ratings.snapshot()
+    index = NeighborIndex.build(ratings, k)
+    with _update_lock:
+        models.neighbors = index
+        models.changedUsers.difference_update(rebuilt_users)
+    return index
+
+def start_neighbor_rebuilds(intervalSeconds):
+    # rebuild the index in a daemon thread whenever ratings changed since the last build,
+    # checked every intervalSeconds; 0 disables the rebuilds and starts no thread
+    if intervalSeconds <= 0:
+        return None
+    def rebuild_loop():
+        while True:
+            time.sleep(intervalSeconds)
+            if Registry.loaded and Registry.get().changedUsers:
+                rebuild_neighbor_index()
+    thread = threading.Thread(target=rebuild_loop, name="neighbor-index-rebuild", daemon=True)
+    thread.start()
+    return thread
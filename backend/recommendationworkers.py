@@ -0,0 +1,151 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# Recommendation worker tier: scoring runs in a pool of worker processes that
+# load the recommender once each, so it doesn't compete with the API for the
+# interpreter. Requests for the same (user, count, engine) that arrive while a
+# job is running share that job, and a request that misses its deadline gets
+# the fallback (popularity) list instead.
+#
+# Workers have their own copy of the ratings. The API process records each app
+# user's whole stored rating set here, and it is sent along with each job and
+# replaces the user's row in the worker, the same way the API process loads
+# the user, so a worker scores a user with their latest ratings.
+#
+# Both sides keep at most WORKER_RATED_USERS users, least recently rated
+# first out. A user dropped here is sent in full again with their next rating;
+# a user a worker dropped is just applied again with their next job.
+WORKER_RATED_USERS = int(os.getenv('WORKER_RATED_USERS', '10000'))
+
+
+class RecommendationWorkers:
+
+    def __init__(self, workers=2, deadlineSeconds=2.0, fallback=None, executor=None, job=None,
+                 maxUsers=WORKER_RATED_USERS):
+        # executor defaults to a process pool of `workers` processes; any
+        # concurrent.futures executor works (e.g. threads sharing the API's recommender)
+        self.workers = workers
+        self.deadlineSeconds = deadlineSeconds
+        self.fallback = fallback or (lambda numReccomendations: [])
+        self._forwardRatings = executor is None
+        self._executor = executor or ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        self._job = job or _recommend
+        self._inFlight = {}  # (userId, count, engine, rating version) -> future of the running job
+        self._maxUsers = maxUsers
+        self._userRatings = OrderedDict()  # userId -> {movieId: rating}, all their ratings, for the workers
+        self._versions = OrderedDict()  # userId -> number of rating updates, part of the coalescing key
+        self._started = time.monotonic()
+        self.busySeconds = 0.0
+        self.submitted = self.completed = self.failed = self.coalesced = self.timeouts = 0
+
+    def has_ratings(self, userId):
+        # whether new ratings of the user can be recorded on their own; otherwise
+        # record all of the user's stored ratings with replace
+        return not self._forwardRatings or userId in self._userRatings
+
+    def record_ratings(self, userId, ratings, replace=False):
+        # called alongside update_user_ratings with the same (movieId, rating) pairs;
+        # later jobs for the user see them
+        if self._forwardRatings:
+            userRatings = {} if replace else self._userRatings.pop(userId, {})
+            userRatings.update(ratings)
+            self._userRatings[userId] = userRatings
+            _keep_latest(self._userRatings, self._maxUsers)
+        self._versions[userId] = self._versions.pop(userId, 0) + 1
+        _keep_latest(self._versions, self._maxUsers)
+
+    def forget_ratings(self):
+        # after the API process reloaded its models; users are recorded again, in
+        # full, when they are next loaded or rate
+        self._userRatings.clear()
+
+    async def recommend(self, userId, numReccomendations, engine):
+        # (movie ids, True if they are the fallback list because the deadline passed)
+        key = (userId, numReccomendations, engine, self._versions.get(userId, 0))
+        future = self._inFlight.get(key)
+        if future is None:
+            ratings = tuple(sorted(self._userRatings.get(userId, {}).items()))
+            future = asyncio.wrap_future(self._executor.submit(self._job, userId, numReccomendations, engine, ratings))
+            self._inFlight[key] = future
+            self.submitted += 1
+            future.add_done_callback(partial(self._finished, key))
+        else:
+            self.coalesced += 1
+        try:
+            # shield so one caller timing out doesn't cancel the job the others wait on
+            movieIds, _ = await asyncio.wait_for(asyncio.shield(future), self.deadlineSeconds)
+            return movieIds, False
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            # off the event loop too: the fallback may wait for the models to load
+            return await asyncio.to_thread(self.fallback, numReccomendations), True
+
+    def stats(self):
+        # queue depth counts jobs waiting for a free worker; utilization is the
+        # share of worker time spent scoring since the pool started
+        inFlight = len(self._inFlight)
+        uptime = time.monotonic() - self._started
+        return {"workers": self.workers, "inFlight": inFlight, "queueDepth": max(inFlight - self.workers, 0),
+                "utilization": self.busySeconds / (self.workers * uptime) if uptime > 0 else 0.0,
+                "submitted": self.submitted, "completed": self.completed, "failed": self.failed,
+                "coalesced": self.coalesced, "timeouts": self.timeouts}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finished(self, key, future):
+        self._inFlight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+            return
+        self.completed += 1
+        self.busySeconds += future.result()[1]
+
+
+def _keep_latest(users, maxUsers):
+    while len(users) > maxUsers:
+        users.popitem(last=False)
+
+
+# the worker's recommender module and the rating set it has applied per user;
+# worker processes look for new artifacts before every job, the API process
+# reloads its models itself
+_recommender = None
+_applied = OrderedDict()
+_reloadOnChange = False
+
+
+def _init_worker():
+    # load the matrix and model artifacts once per worker process
+    global _reloadOnChange
+    _reloadOnChange = True
+    _import_recommender().load_models()
+
+
+def _import_recommender():
+    global _recommender
+    if _recommender is None:
+        import reccomendation_algorithim
+        _recommender = reccomendation_algorithim
+    return _recommender
+
+
+def _recommend(userId, numReccomendations, engine, ratings):
+    # one job: pick up new artifacts if they were rebuilt, load the user's whole
+    # rating set if it changed, then rank with the engine; returns (movie ids, seconds spent)
+    start = time.perf_counter()
+    _import_recommender()
+    if _reloadOnChange and _recommender.Registry.reload_if_changed() is not None:
+        # the new models don't have the ratings applied to the old ones
+        _applied.clear()
+    if len(ratings) > 0:
+        if _applied.pop(userId, None) != ratings:
+            _recommender.update_user_ratings(userId, list(ratings), replace=True)
+        _applied[userId] = ratings
+        _keep_latest(_applied, WORKER_RATED_USERS)
+    recommended = _recommender.recommend(userId, numReccomendations, engine)
+    return [int(movieId) for movieId in recommended], time.perf_counter() - start
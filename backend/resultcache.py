@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Per-user recommendation result cache: a bounded in-process LRU with a TTL,
+# optionally backed by a shared store so several API workers can reuse results.
+# A shared backend needs get(key) and set(key, value, ttlSeconds);
+# LocalBackend is an in-process stand-in with that interface (e.g. for Redis).
+
+
+class LocalBackend:
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= self._clock():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttlSeconds=None):
+        with self._lock:
+            expires = None if ttlSeconds is None else self._clock() + ttlSeconds
+            self._entries[key] = (expires, value)
+
+
+class ResultCache:
+
+    def __init__(self, maxSize=1024, ttlSeconds=300, backend=None, clock=time.monotonic):
+        self.maxSize = maxSize
+        self.ttlSeconds = ttlSeconds
+        self.backend = backend
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires, userId, value), least recently used first
+        self._userKeys = {}  # userId -> keys cached for that user
+        self._generations = {}  # userId -> number of invalidations of that user
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+        self.staleWrites = 0
+
+    def get(self, userId, *params):
+        key = self._key(userId, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, _, value = entry
+                if expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+                self.expirations += 1
+        value = self.backend.get(key) if self.backend is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, userId, value)
+        return value
+
+    def generation(self, userId):
+        # changes whenever the user is invalidated; take it at a cache miss, before
+        # computing the value, and pass it to put()
+        with self._lock:
+            localGeneration = self._generations.get(userId, 0)
+        if self.backend is not None:
+            return localGeneration, self.backend.get(f"recs-generation:{userId}") or 0
+        return localGeneration, 0
+
+    def put(self, userId, *params, value, generation=None):
+        # with generation, a value computed before the user was invalidated (e.g. a job that
+        # started before the user rated a movie and finished after) is dropped, not cached
+        key = self._key(userId, params)
+        if generation is not None and generation != self.generation(userId):
+            with self._lock:
+                self.staleWrites += 1
+            return
+        with self._lock:
+            self._store(key, userId, value)
+        if self.backend is not None:
+            self.backend.set(key, value, self.ttlSeconds)
+
+    def invalidate_user(self, userId):
+        # drop every cached result of the user; in the shared backend the user's
+        # generation is bumped so keys written by other workers stop matching too
+        with self._lock:
+            for key in list(self._userKeys.get(userId, ())):
+                self._remove(key)
+            self._generations[userId] = self._generations.get(userId, 0) + 1
+            self.invalidations += 1
+        if self.backend is not None:
+            generationKey = f"recs-generation:{userId}"
+            self.backend.set(generationKey, (self.backend.get(generationKey) or 0) + 1)
+
+    def clear(self):
+        # drop every locally cached result, e.g. when the models are reloaded
+        with self._lock:
+            self._entries.clear()
+            self._userKeys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxSize": self.maxSize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations,
+                    "invalidations": self.invalidations, "staleWrites": self.staleWrites}
+
+    def _key(self, userId, params):
+        generation = 0
+        if self.backend is not None:
+            generation = self.backend.get(f"recs-generation:{userId}") or 0
+        return ":".join(str(part) for part in ("recs", userId, *params, generation))
+
+    def _store(self, key, userId, value):
+        self._entries[key] = (self._clock() + self.ttlSeconds, userId, value)
+        self._entries.move_to_end(key)
+        self._userKeys.setdefault(userId, set()).add(key)
+        while len(self._entries) > self.maxSize:
+            oldestKey = next(iter(self._entries))
+            self._remove(oldestKey)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, userId, _ = self._entries.pop(key)
+        userKeys = self._userKeys.get(userId)
+        if userKeys is not None:
+            userKeys.discard(key)
+            if not userKeys:
+                del self._userKeys[userId]
@@ -1,126 +1,144 @@
+import argparse
+import io
 import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, ForeignKey, Column, String, Integer, CHAR
-from sqlalchemy.orm import declarative_base, sessionmaker
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Retrieve variables from environment
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASSWORD')
-db_host = os.getenv('DB_HOST')
-db_port = os.getenv('DB_PORT')
-db_name = os.getenv('DB_NAME')
-
-
-Base = declarative_base()
-
-class User(Base):
-    __tablename__ = "users"
-
-    email = Column("email", String, primary_key=True)
-
-    def __init__(self, email):
-        self.email = email
-
-    # for printing User objects
-    def __repr__(self):
-        return f"{self.email}"
-
-class Movie(Base):
-    __tablename__ = "movies"
-
-    id = Column("id", Integer, primary_key=True, autoincrement=True)
-    name = Column("name",String, nullable=False)
-    description = Column("description", String, nullable=False)
-    imageUrl = Column("imageUrl", String, nullable=False)
-
-    # owner = Column(Integer, ForeignKey("people.ssn"))
-
-    def __init__(self, name, description, imageUrl):
-        self.name = name
-        self.description = description
-        self.imageUrl = imageUrl
-
-    def __repr__(self):
-        return f"({self.id}) {self.name}"
-
-
-class Rating(Base):
-    __tablename__ = "ratings"
-
-    id = Column("id", Integer, primary_key=True, autoincrement=True)
-    userEmail = Column(String, ForeignKey("users.email"), nullable=False)  # Reference to User.email
-    movieId = Column(Integer, ForeignKey("movies.id"), nullable=False)
-    rating = Column("rating", Integer, nullable=True)
-
-    def __init__(self, userEmail, movieId, rating):
-        self.userEmail = userEmail
-        self.movieId = movieId
-        self.rating = rating
-
-    def __repr__(self):
-        return f"({self.userEmail}) ({self.movieId}) {self.rating}"
-
-
-# connect to postgres    
-database_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-engine = create_engine(database_url)
-
-# use a local sqlite db (doesn't support postgres features)
-# engine = create_engine('sqlite:///local_database.db')
-
-# take classes extending from base and create them in db
-Base.metadata.create_all(bind=engine)
-
-# create session to interact with the db
-Session = sessionmaker(bind=engine)
-session = Session()
-
-u = User("hollandpleskac@gmail.com")
-session.add(u) # add person to db
-session.commit() # apply changes to db
-
-# List of movies
-movies_list = [
-    "1,Toy Story (1995),Adventure|Animation|Children|Comedy|Fantasy",
-    "2,Jumanji (1995),Adventure|Children|Fantasy",
-    "3,Grumpier Old Men (1995),Comedy|Romance",
-    "4,Waiting to Exhale (1995),Comedy|Drama|Romance",
-    "5,Father of the Bride Part II (1995),Comedy",
-    "6,Heat (1995),Action|Crime|Thriller",
-    "7,Sabrina (1995),Comedy|Romance",
-    "8,Tom and Huck (1995),Adventure|Children",
-    "9,Sudden Death (1995),Action",
-    "10,GoldenEye (1995),Action|Adventure|Thriller",
-    "11,American President, The (1995),Comedy|Drama|Romance",
-    "12,Dracula: Dead and Loving It (1995),Comedy|Horror",
-    "13,Balto (1995),Adventure|Animation|Children",
-    "14,Nixon (1995),Drama",
-    "15,Cutthroat Island (1995),Action|Adventure|Romance",
-    "16,Casino (1995),Crime|Drama",
-    "17,Sense and Sensibility (1995),Drama|Romance",
-    "18,Four Rooms (1995),Comedy",
-    "19,Ace Ventura: When Nature Calls (1995),Comedy",
-    "20,Money Train (1995),Action|Comedy|Crime|Drama|Thriller",
-    "21,Get Shorty (1995),Comedy|Crime|Thriller"
-]
-
-# Loop over the list of movies
-for movie_entry in movies_list:
-    _, name, genres = movie_entry.split(',', 2)  # Split each string into parts
-
-    # Create a new Movie object
-    m = Movie(name, genres, "https://www.twincities.com/wp-content/uploads/2022/05/Summer_Film_Preview_71939.jpg")
-
-    # Add to the session and commit
-    session.add(m)
-
-# Commit all changes to the database
-session.commit()
-
-# Close the session
-session.close()
-
-print("Done")
\ No newline at end of file
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db import Base, User, Movie, Rating, create_engine, database_url
+
+# Bulk loader for the movie catalog (movies.csv) and the MovieLens ratings
+# (ratings.csv). Both files are streamed in chunks: on postgres every chunk is
+# COPYed into a staging table and merged with INSERT ... SELECT ... ON CONFLICT,
+# elsewhere (sqlite) it is written with batched executemany upserts. Movies keep
+# their MovieLens id as their database id, the ids the recommender matrix uses,
+# and every MovieLens user gets a user row. Running it again changes nothing.
+#   python seed-db.py [--database-url sqlite:///local_database.db] [--movies movies.csv] [--ratings ratings.csv]
+
+
+IMAGE_URL = "https://www.twincities.com/wp-content/uploads/2022/05/Summer_Film_Preview_71939.jpg"
+APP_USER = "hollandpleskac@gmail.com"
+
+# rows per executemany batch on sqlite
+BATCH_SIZE = 5000
+
+# email of the user row of each MovieLens user; the API maps these emails back to the
+# users' rows in the recommender matrix, so it reads the same MOVIELENS_EMAIL_TEMPLATE
+EMAIL_TEMPLATE = os.getenv('MOVIELENS_EMAIL_TEMPLATE', 'movielens{userId}@moviemate.local')
+
+
+def movielens_email(userId, template):
+    return template.format(userId=userId)
+
+
+def movie_chunks(moviesPath, chunksize):
+    # the catalog as movie rows, keeping the MovieLens id; genres are the description
+    for chunk in pd.read_csv(moviesPath, usecols=['movieId', 'title', 'genres'], chunksize=chunksize):
+        yield pd.DataFrame({"id": chunk['movieId'].astype(int), "name": chunk['title'],
+                            "description": chunk['genres'], "imageUrl": IMAGE_URL})
+
+
+def rating_chunks(ratingsPath, chunksize, emailTemplate):
+    # MovieLens ratings (0.5 to 5 in half stars) as whole-star rating rows, half stars rounded up
+    for chunk in pd.read_csv(ratingsPath, usecols=['userId', 'movieId', 'rating'], chunksize=chunksize):
+        yield pd.DataFrame({"userEmail": [movielens_email(userId, emailTemplate) for userId in chunk['userId']],
+                            "movieId": chunk['movieId'].astype(int),
+                            "rating": np.floor(chunk['rating'].to_numpy() + 0.5).astype(int)})
+
+
+def upsert(connection, table, frame, conflict, update=()):
+    # insert the rows of frame, skipping (or, for the update columns, overwriting) rows
+    # that already exist by the conflict columns
+    if len(frame) == 0:
+        return
+    if connection.dialect.name == 'postgresql':
+        copy_upsert(connection, table, frame, conflict, update)
+        return
+    statement = sqlite_insert(table)
+    if update:
+        statement = statement.on_conflict_do_update(index_elements=list(conflict),
+                                                    set_={column: statement.excluded[column] for column in update})
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=list(conflict))
+    rows = frame.to_dict('records')
+    for start in range(0, len(rows), BATCH_SIZE):
+        connection.execute(statement, rows[start:start + BATCH_SIZE])
+
+
+def copy_upsert(connection, table, frame, conflict, update):
+    # COPY the rows into a temporary staging table, then merge them in one statement
+    columns = ", ".join(f'"{column}"' for column in frame.columns)
+    staging = f"staging_{table.name}"
+    connection.execute(text(f'CREATE TEMP TABLE IF NOT EXISTS {staging} AS SELECT {columns} FROM "{table.name}" WITH NO DATA'))
+    connection.execute(text(f"TRUNCATE {staging}"))
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    cursor = connection.connection.cursor()
+    copy_sql = f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    if hasattr(cursor, 'copy'):
+        # psycopg 3
+        with cursor.copy(copy_sql) as copy:
+            copy.write(buffer.getvalue())
+    else:
+        # psycopg2
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+    conflictColumns = ", ".join(f'"{column}"' for column in conflict)
+    action = "DO NOTHING" if not update else \
+        "DO UPDATE SET " + ", ".join(f'"{column}" = EXCLUDED."{column}"' for column in update)
+    # DISTINCT ON keeps one row per conflict key, ON CONFLICT can't touch a row twice
+    connection.execute(text(f'INSERT INTO "{table.name}" ({columns}) SELECT DISTINCT ON ({conflictColumns}) {columns} '
+                            f'FROM {staging} ON CONFLICT ({conflictColumns}) {action}'))
+
+
+def seed(engine, moviesPath, ratingsPath, chunksize=50000, emailTemplate=EMAIL_TEMPLATE):
+    Base.metadata.create_all(bind=engine)
+    counts = {"movies": 0, "users": 0, "ratings": 0, "skipped ratings": 0}
+    seenUsers = set()
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        upsert(connection, User.__table__, pd.DataFrame({"email": [APP_USER]}), ["email"])
+        for movies in movie_chunks(moviesPath, chunksize):
+            upsert(connection, Movie.__table__, movies, ["id"])
+            counts["movies"] += len(movies)
+        if connection.dialect.name == 'postgresql':
+            # explicit ids don't advance the id sequence, movies added later must not reuse them
+            connection.execute(text("SELECT setval(pg_get_serial_sequence('movies', 'id'), "
+                                    "(SELECT COALESCE(MAX(id), 1) FROM movies))"))
+        knownMovieIds = set(connection.execute(select(Movie.id)).scalars())
+
+        if ratingsPath is not None:
+            for ratings in rating_chunks(ratingsPath, chunksize, emailTemplate):
+                # ratings of movies that aren't in the catalog can't be stored
+                known = ratings['movieId'].isin(knownMovieIds)
+                counts["skipped ratings"] += int((~known).sum())
+                ratings = ratings[known]
+                # a user's ratings can span chunks, only the users not written yet are sent
+                users = pd.DataFrame({"email": [email for email in ratings['userEmail'].unique() if email not in seenUsers]})
+                seenUsers.update(users['email'])
+                upsert(connection, User.__table__, users, ["email"])
+                upsert(connection, Rating.__table__, ratings, ["userEmail", "movieId"], update=["rating"])
+                counts["users"] += len(users)
+                counts["ratings"] += len(ratings)
+    return counts, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load movies.csv and ratings.csv into the database")
+    parser.add_argument('--database-url', default=database_url())
+    parser.add_argument('--movies', default='movies.csv')
+    parser.add_argument('--ratings', default='ratings.csv')
+    parser.add_argument('--no-ratings', action='store_true', help="load the movie catalog only")
+    parser.add_argument('--chunksize', type=int, default=50000)
+    parser.add_argument('--email-template', default=EMAIL_TEMPLATE,
+                        help="email of the user row created for each MovieLens user")
+    args = parser.parse_args()
+
+    counts, elapsed = seed(create_engine(args.database_url), args.movies, None if args.no_ratings else args.ratings,
+                           args.chunksize, args.email_template)
+    rows = counts["movies"] + counts["users"] + counts["ratings"]
+    print(f"{counts['movies']} movies, {counts['users']} users, {counts['ratings']} ratings "
+          f"({counts['skipped ratings']} ratings of unknown movies skipped) in {elapsed:.2f}s, {rows / elapsed:.0f} rows/s")
@@ -0,0 +1,158 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Vectorized Pearson similarity between users of a user-item matrix.
+# Ratings are either a RatingsMatrix (sparse) or a 2D float array
+# (users x movies) where NaN means "not rated".
+# Both are reduced to per-user sums over the common movies; the correlation is
+# then taken from the ratings centered on each pair's own means, as
+# pearson_correlation does, since the raw sums lose digits to cancellation.
+# The rules match pearson_correlation in reccomendation_algorithim.py:
+#   - fewer than 2 commonly rated movies      -> 0
+#   - identical ratings on the common movies  -> 1
+#   - zero variance for either user           -> 0
+# Correlations are rounded to 12 decimals, so equal correlations (exactly
+# correlated users at +-1 in particular) tie, in user order, instead of being
+# ordered by rounding noise.
+
+
+def pearson_from_centered(n, sxx, syy, cxy, cxx, cyy, sdd):
+    # correlations from each pair's common movies: their count n, the sums of the
+    # target's (x) and the other users' (y) squared ratings, the sums of the centered
+    # products and squares, and the sum of the squared differences x - y
+    # (zero exactly when the ratings are identical)
+    identical = sdd == 0
+    # constant ratings: no variance, up to rounding of the means
+    constant = (cxx <= 1e-9 * sxx) | (cyy <= 1e-9 * syy)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = np.round(np.clip(cxy / np.sqrt(cxx * cyy), -1.0, 1.0), 12)
+
+    result = np.zeros(len(n))
+    valid = (n > 1) & ~identical & ~constant
+    result[valid] = corr[valid]
+    result[(n > 1) & identical] = 1.0
+    return result
+
+
+def pearson_against(ratings, target):
+    # correlation of every row of a dense ratings array with the target row,
+    # both restricted to the same columns, NaN where unrated
+    common = ~np.isnan(ratings) & ~np.isnan(target)
+    n = common.sum(axis=1)
+    x = np.where(common, target, 0.0)
+    y = np.where(common, ratings, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xc = np.where(common, x - (x.sum(axis=1) / n)[:, None], 0.0)
+        yc = np.where(common, y - (y.sum(axis=1) / n)[:, None], 0.0)
+    return pearson_from_centered(n, (x * x).sum(axis=1), (y * y).sum(axis=1), (xc * yc).sum(axis=1),
+                                 (xc * xc).sum(axis=1), (yc * yc).sum(axis=1), ((x - y) ** 2).sum(axis=1))
+
+
+def pearson_against_sparse(columns, target):
+    # the same for a sparse users x columns block: the counts and means are sparse
+    # matrix-vector products and the centered sums one pass over the stored
+    # ratings, so memory stays at the block's stored ratings instead of users x columns
+    rated = columns.copy()
+    rated.data = np.ones_like(rated.data)
+    n = rated @ np.ones(len(target))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        meanX = (rated @ target) / n
+        meanY = (columns @ np.ones(len(target))) / n
+    block = columns.tocoo()
+    x, y = target[block.col], block.data
+    xc, yc = x - meanX[block.row], y - meanY[block.row]
+
+    def row_sums(values):
+        return np.bincount(block.row, weights=values, minlength=len(n))
+
+    return pearson_from_centered(n, rated @ (target * target), row_sums(y * y), row_sums(xc * yc),
+                                 row_sums(xc * xc), row_sums(yc * yc), row_sums((x - y) ** 2))
+
+
+def user_similarities(ratings, userIdx):
+    # Pearson correlation of one user against every user (itself included).
+    # Only the columns the user rated can contribute to a correlation.
+    if isinstance(ratings, np.ndarray):
+        target = ratings[userIdx]
+        rated = ~np.isnan(target)
+        return pearson_against(ratings[:, rated], target[rated])
+    cols, target = ratings.user_row(userIdx)
+    return pearson_against_sparse(ratings.column_block(cols), np.asarray(target, dtype=float))
+
+
+def similarity_matrix(ratings):
+    # full users x users Pearson matrix, one vectorized row at a time
+    numUsers = ratings.shape[0]
+    result = np.empty((numUsers, numUsers))
+    for userIdx in range(numUsers):
+        result[userIdx] = user_similarities(ratings, userIdx)
+    return result
+
+
+class SimilarityCache:
+    # LRU cache of per-user similarity rows over a RatingsMatrix.
+    # refresh_user keeps it consistent after one user's ratings change.
+    # Safe to share between threads: rows are computed on a snapshot of the
+    # matrix outside the lock, a row computed on a version that has been
+    # replaced meanwhile is returned but not cached, and cached rows are never
+    # changed, refresh_user stores patched copies.
+    # At most maxUsers rows, or with maxBytes as many rows of the matrix's
+    # width as fit in it; every rating write copies all of them.
+
+    def __init__(self, ratings, maxUsers=1024, maxBytes=None):
+        self.ratings = ratings
+        self.maxUsers = maxUsers
+        self.maxBytes = maxBytes
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, userIdx, ratings=None):
+        # the user's row against ratings, a snapshot of the matrix (the current one
+        # by default), so the row matches the users the caller indexes it with
+        ratings = ratings if ratings is not None else self.ratings.snapshot()
+        with self._lock:
+            row = self._rows.get(userIdx)
+            if row is not None and len(row) == ratings.shape[0]:
+                self._rows.move_to_end(userIdx)
+                return row
+        row = user_similarities(ratings, userIdx)
+        with self._lock:
+            if ratings.version == self.ratings.version:
+                self._store(userIdx, row)
+        return row
+
+    def refresh_user(self, userIdx):
+        # Recompute the changed user's row, O(ratings in the user's columns),
+        # then patch that user's entry in every cached row by symmetry, O(users).
+        # Called by the writer after each update; a reader holding a cached row
+        # keeps the old similarity of that pair, later readers get the patched copy.
+        ratings = self.ratings.snapshot()
+        row = user_similarities(ratings, userIdx)
+        with self._lock:
+            for otherIdx, otherRow in list(self._rows.items()):
+                if len(otherRow) == len(row) - 1 and userIdx == len(row) - 1:
+                    # the changed user was just appended to the matrix
+                    otherRow = np.append(otherRow, 0.0)
+                elif len(otherRow) != len(row):
+                    del self._rows[otherIdx]
+                    continue
+                else:
+                    otherRow = otherRow.copy()
+                otherRow[userIdx] = row[otherIdx]
+                self._rows[otherIdx] = otherRow
+            self._store(userIdx, row)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def _store(self, userIdx, row):
+        self._rows[userIdx] = row
+        self._rows.move_to_end(userIdx)
+        maxUsers = self.maxUsers
+        if self.maxBytes is not None:
+            maxUsers = max(1, int(self.maxBytes // row.nbytes))
+        while len(self._rows) > maxUsers:
+            self._rows.popitem(last=False)
@@ -1,82 +1,14 @@
-import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, ForeignKey, Column, String, Integer, CHAR
-from sqlalchemy.orm import declarative_base, sessionmaker
+from db import Base, User, Movie, Rating, get_engine, open_session
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Retrieve variables from environment
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASSWORD')
-db_host = os.getenv('DB_HOST')
-db_port = os.getenv('DB_PORT')
-db_name = os.getenv('DB_NAME')
-
-
-Base = declarative_base()
-
-class User(Base):
-    __tablename__ = "users"
-
-    email = Column("email", String, primary_key=True)
-
-    def __init__(self, email):
-        self.email = email
-
-    # for printing User objects
-    def __repr__(self):
-        return f"{self.email}"
-
-class Movie(Base):
-    __tablename__ = "movies"
-
-    id = Column("id", Integer, primary_key=True, autoincrement=True)
-    name = Column("name",String, nullable=False)
-    description = Column("description", String, nullable=False)
-    imageUrl = Column("imageUrl", String, nullable=False)
-
-    # owner = Column(Integer, ForeignKey("people.ssn"))
-
-    def __init__(self, name, description, imageUrl):
-        self.name = name
-        self.description = description
-        self.imageUrl = imageUrl
-
-    def __repr__(self):
-        return f"({self.id}) {self.name}"
-
-
-class Rating(Base):
-    __tablename__ = "ratings"
-
-    id = Column("id", Integer, primary_key=True, autoincrement=True)
-    userEmail = Column(String, ForeignKey("users.email"), nullable=False)  # Reference to User.email
-    movieId = Column(Integer, ForeignKey("movies.id"), nullable=False)
-    rating = Column("rating", Integer, nullable=True)
-
-    def __init__(self, userEmail, movieId, rating):
-        self.userEmail = userEmail
-        self.movieId = movieId
-        self.rating = rating
-
-    def __repr__(self):
-        return f"({self.userEmail}) ({self.movieId}) {self.rating}"
-
-
-# connect to postgres    
-database_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-engine = create_engine(database_url)
-
-# use a local sqlite db (doesn't support postgres features)
-# engine = create_engine('sqlite:///local_database.db')
+# engine and sessions come from the db package: DATABASE_URL (or the DB_* variables)
+# picks the database, e.g. DATABASE_URL=sqlite:///local_database.db for a local sqlite db
+engine = get_engine()
 
 # take classes extending from base and create them in db
 Base.metadata.create_all(bind=engine)
 
 # create session to interact with the db
-Session = sessionmaker(bind=engine)
-session = Session()
+session = open_session()
 
 
 # # Add row to table
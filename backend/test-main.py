@@ -1,80 +1,12 @@
 import pytest
-import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, ForeignKey, Column, String, Integer
-from sqlalchemy.orm import declarative_base, sessionmaker
 import requests
+from db import Base, User, Movie, Rating, get_engine, open_session
 
 # ---- SETUPBASE SQL DB ------
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Retrieve variables from environment
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASSWORD')
-db_host = os.getenv('DB_HOST')
-db_port = os.getenv('DB_PORT')
-db_name = os.getenv('DB_NAME')
-
-
-Base = declarative_base()
-
-class User(Base):
-    __tablename__ = "users"
-
-    email = Column("email", String, primary_key=True)
-
-    def __init__(self, email):
-        self.email = email
-
-    # for printing User objects
-    def __repr__(self):
-        return f"{self.email}"
-
-class Movie(Base):
-    __tablename__ = "movies"
-
-    id = Column("id", Integer, primary_key=True, autoincrement=True)
-    name = Column("name",String, nullable=False)
-    description = Column("description", String, nullable=False)
-    imageUrl = Column("imageUrl", String, nullable=False)
-
-    # owner = Column(Integer, ForeignKey("people.ssn"))
-
-    def __init__(self, name, description, imageUrl):
-        self.name = name
-        self.description = description
-        self.imageUrl = imageUrl
-
-    def __repr__(self):
-        return f"({self.id}) {self.name}"
-
-
-class Rating(Base):
-    __tablename__ = "ratings"
-
-    id = Column("id", Integer, primary_key=True, autoincrement=True)
-    userEmail = Column(String, ForeignKey("users.email"), nullable=False)  # Reference to User.email
-    movieId = Column(Integer, ForeignKey("movies.id"), nullable=False)
-    rating = Column("rating", Integer, nullable=True)
-
-    def __init__(self, userEmail, movieId, rating):
-        self.userEmail = userEmail
-        self.movieId = movieId
-        self.rating = rating
-
-    def __repr__(self):
-        return f"({self.userEmail}) ({self.movieId}) {self.rating}"
-
-TEST_DATABASE_URL = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-
-# Create an engine to the test database
-engine = create_engine(TEST_DATABASE_URL)
-
-# Use scoped_session to ensure thread safety
-Session = sessionmaker(bind=engine)
-db_session = Session()
+# the test database is the one the db package is configured for (DATABASE_URL or DB_*)
+engine = get_engine()
+db_session = open_session()
 
 # Before running this, seed the db correctly
 Base.metadata.drop_all(engine)
@@ -261,8 +193,7 @@ Base.metadata.create_all(engine)
 
 
 # create session to interact with the db
-Session = sessionmaker(bind=engine)
-session = Session()
+session = open_session()
 
 u = User("hollandpleskac@gmail.com")
 session.add(u) # add person to db
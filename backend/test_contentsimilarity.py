@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+import contentsimilarity
+from contentsimilarity import GenreBitsets, pack_flags, popcount
+
+
+def catalog(metric='jaccard'):
+    return GenreBitsets.from_frame(pd.DataFrame({
+        "movieId": [1, 2, 3, 4], "title": ["a", "b", "c", "d"], "year": [1995, 1995, 2015, np.nan],
+        "Action": [1, 1, 0, 1], "Comedy": [1, 0, 0, 1], "Drama": [0, 0, 1, 1]}), metric)
+
+
+def test_packed_popcount_matches_the_flags():
+    flags = np.random.default_rng(0).integers(0, 2, size=(50, 70))
+    bits = pack_flags(flags)
+    assert bits.shape == (50, 2)
+    assert popcount(bits).sum(axis=1).tolist() == flags.sum(axis=1).tolist()
+
+def test_popcount_without_bitwise_count(monkeypatch):
+    words = np.array([0, 1, 2**63 + 5, 2**64 - 1], dtype=np.uint64)
+    monkeypatch.delattr(np, 'bitwise_count', raising=False)
+    assert contentsimilarity.popcount(words).tolist() == [0, 1, 3, 64]
+
+def test_genre_similarities():
+    index = catalog()
+    # {Action, Comedy} against {Action}, {Action, Comedy}, {Drama}, {Action, Comedy, Drama}
+    assert np.allclose(index.genre_similarities(0), [1, 1 / 2, 0, 2 / 3])
+    assert np.allclose(catalog('cosine').genre_similarities(0), [1, 1 / np.sqrt(2), 0, 2 / np.sqrt(6)])
+
+def test_similar_movies_blend_year_proximity():
+    index = catalog()
+    similar = index.similar_movies(1, 3)
+    # movie 2 shares half the genres and the year, movie 4 two thirds and no known year
+    assert [movieId for movieId, _ in similar] == [2, 4, 3]
+    assert index.similar_movies(5) is None
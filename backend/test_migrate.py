@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from migrate import migrate, MIGRATIONS
+
+
+def old_database():
+    # the ratings table as create_all made it before the unique index, with a duplicate rating
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE ratings (id INTEGER PRIMARY KEY, "userEmail" VARCHAR NOT NULL, '
+                                '"movieId" INTEGER NOT NULL, rating INTEGER)'))
+        connection.execute(text('INSERT INTO ratings ("userEmail", "movieId", rating) VALUES '
+                                "('a@example.com', 1, 3), ('a@example.com', 2, 4), ('a@example.com', 1, 5)"))
+    return engine
+
+
+def test_migrate_dedupes_and_adds_unique_index():
+    engine = old_database()
+    assert migrate(engine) == [version for version, _, _ in MIGRATIONS]
+    with engine.connect() as connection:
+        rows = connection.execute(text('SELECT "movieId", rating FROM ratings ORDER BY "movieId"')).all()
+    # the latest of the duplicates is kept
+    assert [tuple(row) for row in rows] == [(1, 5), (2, 4)]
+    indexes = {index["name"]: index for index in inspect(engine).get_indexes("ratings")}
+    assert indexes["uq_ratings_user_movie"]["unique"]
+    with pytest.raises(IntegrityError):
+        with engine.begin() as connection:
+            connection.execute(text('INSERT INTO ratings ("userEmail", "movieId", rating) VALUES (\'a@example.com\', 2, 1)'))
+
+def test_migrate_runs_each_migration_once():
+    engine = old_database()
+    migrate(engine)
+    assert migrate(engine) == []
+
+def test_migrate_needs_the_tables():
+    with pytest.raises(RuntimeError):
+        migrate(create_engine("sqlite://"))
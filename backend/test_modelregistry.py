@@ -0,0 +1,45 @@
+import os
+import shutil
+
+from modelregistry import ModelRegistry
+import reccomendation_algorithim
+
+
+def copy_matrix(tmp_path):
+    path = str(tmp_path / 'matrix.csv')
+    shutil.copy('testcentereduseritem_matrix.csv', path)
+    return path
+
+
+def test_models_load_on_first_use(tmp_path):
+    registry = ModelRegistry(copy_matrix(tmp_path))
+    assert not registry.loaded
+    assert registry.stats() == {"loaded": False, "matrixPath": registry.matrixPath, "reloads": 0}
+    models = registry.get()
+    assert registry.loaded
+    assert registry.get() is models
+    assert models.ratings.shape == (8, 13)
+    assert models.neighbors is None
+
+def test_reload_if_changed_picks_up_rebuilt_artifacts(tmp_path):
+    path = copy_matrix(tmp_path)
+    registry = ModelRegistry(path)
+    old = registry.get()
+    assert registry.reload_if_changed() is None
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    new = registry.reload_if_changed()
+    assert new is not None and new is not old
+    assert registry.get() is new
+    assert registry.reloads == 1
+    assert registry.reload_if_changed() is None
+
+def test_app_users_keep_their_id_across_reloads(tmp_path, monkeypatch):
+    monkeypatch.setattr(reccomendation_algorithim, 'Registry', ModelRegistry(copy_matrix(tmp_path)))
+    userId = reccomendation_algorithim.recommender_user_id('reload@example.com', create=True)
+    reccomendation_algorithim.update_user_rating(userId, 1, 4.0)
+    reccomendation_algorithim.reload_models()
+    # the new models don't have the user's ratings until they are loaded again
+    assert reccomendation_algorithim.recommender_user_id('reload@example.com') is None
+    assert not reccomendation_algorithim.Ratings.has_user(userId)
+    assert reccomendation_algorithim.recommender_user_id('reload@example.com', create=True) == userId
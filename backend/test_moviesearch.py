@@ -0,0 +1,46 @@
+from moviesearch import MovieSearchIndex
+
+MOVIES = [
+    (1, "Toy Story (1995)", "Adventure|Animation|Children|Comedy|Fantasy"),
+    (2, "Jumanji (1995)", "Adventure|Children|Fantasy"),
+    (3, "Toy Story 2 (1999)", "Adventure|Animation|Children|Comedy|Fantasy"),
+    (4, "Story of Us, The (1999)", "Comedy|Drama"),
+    (5, "Star Wars: Episode IV - A New Hope (1977)", "Action|Adventure|Sci-Fi"),
+    (6, "Untitled", "(no genres listed)"),
+]
+
+
+def ids(results):
+    return [movie["id"] for movie in results]
+
+
+def test_search_matches_word_prefixes_of_every_query_word():
+    index = MovieSearchIndex(MOVIES)
+    total, results = index.search("toy sto")
+    assert total == 2
+    assert ids(results) == [1, 3]
+    assert index.search("toy jum") == (0, [])
+
+def test_search_ranks_whole_words_and_titles_first():
+    index = MovieSearchIndex(MOVIES)
+    # "story" is a whole title word of all three, the shortest title wins the tie
+    assert ids(index.search("story")[1]) == [1, 3, 4]
+    assert ids(index.search("scifi")[1]) == [5]
+    # a title word outranks a genre, even of a longer title
+    index = MovieSearchIndex([(1, "Up (2009)", "Drama"), (2, "Drama Queen (2001)", "Comedy")])
+    assert ids(index.search("drama")[1]) == [2, 1]
+
+def test_search_filters_by_year():
+    index = MovieSearchIndex(MOVIES)
+    assert ids(index.search("story", year=1999)[1]) == [3, 4]
+    # without words, the movies of the year
+    assert ids(index.search("", year=1995)[1]) == [2, 1]
+    assert index.search("") == (0, [])
+    assert index.search("untitled")[1][0]["year"] is None
+
+def test_search_pages_through_ranked_results():
+    index = MovieSearchIndex(MOVIES)
+    total, everything = index.search("adv")
+    pages = [index.search("adv", offset=offset, limit=2) for offset in range(0, total, 2)]
+    assert all(pageTotal == total for pageTotal, _ in pages)
+    assert [movie for _, page in pages for movie in page] == everything
@@ -0,0 +1,50 @@
+import pandas as pd
+
+import reccomendation_algorithim
+from popularitytables import PopularityTables
+
+DAY = 86400
+
+
+def ratings():
+    # movie 1: many good ratings long ago; 2: a single 5; 3: fewer good ratings, all recent; 4: recent bad ones
+    rows = [(user, 1, 4.5, 0) for user in range(10)] + [(10, 2, 5.0, 0)] + \
+           [(user, 3, 4.5, 1000 * DAY) for user in range(4)] + [(user, 4, 2.0, 1000 * DAY) for user in range(4)]
+    return pd.DataFrame(rows, columns=['userId', 'movieId', 'rating', 'timestamp'])
+
+
+def movies():
+    return pd.DataFrame({"movieId": [1, 2, 3, 4], "genres": ["Drama", "Drama|Comedy", "Comedy", "(no genres listed)"]})
+
+
+def test_bayesian_average_needs_votes():
+    tables = PopularityTables.build(ratings(), movies())
+    # the single 5.0 is pulled towards the global mean, below ten and four 4.5s
+    assert tables.popular(4) == [1, 3, 2, 4]
+    assert tables.popular(2) == [1, 3]
+
+def test_trending_favours_recent_ratings():
+    tables = PopularityTables.build(ratings(), movies(), halfLifeDays=30)
+    assert tables.trending(2) == [3, 4]
+
+def test_genre_lists(tmp_path):
+    tables = PopularityTables.build(ratings(), movies())
+    assert tables.genres == ["Comedy", "Drama"]
+    assert tables.genre("comedy", 5) == [3, 2]
+    assert tables.genre("Drama", 1) == [1]
+    assert tables.genre("Horror", 5) is None
+    path = str(tmp_path / "matrix_popularity.npz")
+    tables.save(path)
+    loaded = PopularityTables.load(path)
+    assert loaded.popular(4) == tables.popular(4)
+    assert loaded.trending(4) == tables.trending(4)
+    assert loaded.genre("Drama", 5) == [1, 2]
+
+def test_recommender_serves_the_tables(monkeypatch):
+    models = reccomendation_algorithim.Registry.get()
+    monkeypatch.setattr(models, 'popularity', PopularityTables.build(ratings(), movies()))
+    assert reccomendation_algorithim.popular_movies(2) == [1, 3]
+    assert reccomendation_algorithim.genre_movies("Comedy", 1) == [3]
+    monkeypatch.setattr(models, 'popularity', None)
+    assert reccomendation_algorithim.genre_movies("Comedy", 1) is None
+    assert reccomendation_algorithim.trending_movies(3) == reccomendation_algorithim.popular_movies(3)
@@ -1,7 +1,20 @@
 import pytest
 import pandas as pd
-from reccomendation_algorithim import pearson_correlation, find_nearest_neighbor, predict_rating, reccomend_movies
-from moviespreprocess import extractYear, cleanTitle
+import numpy as np
+from reccomendation_algorithim import pearson_correlation, find_nearest_neighbor, predict_rating, reccomend_movies, predict_ratings, user_ratings, Ratings, reccomend_movies_item_based, reccomend_movies_matrix_factorization, rank_user_based
+from similarity import user_similarities, similarity_matrix, SimilarityCache
+from ratingsmatrix import RatingsMatrix
+from modelregistry import ModelRegistry
+from ratingspreprocess import preprocess_streaming
+from neighborindex import NeighborIndex
+from itemsimilarity import ItemSimilarityIndex
+from matrixfactorization import MatrixFactorization
+from trainmf import holdout_split
+from ranking import top_k, top_k_rows
+import reccomendation_algorithim
+from moviespreprocess import extractYear, cleanTitle, preprocess, preprocess_apply, load_encoded
+from contentsimilarity import GenreBitsets
+from batchscoring import recommend_batch
 
 
 def test_pearson_correlation():
@@ -33,6 +46,125 @@ def test_pearson_opposite_ratings():
     correlation = pearson_correlation(5, 6)
     assert correlation < 0
 
+def test_vectorized_similarity_matches_pearson_correlation():
+    for userIdx, user1 in enumerate(Ratings.userIds):
+        similarities = user_similarities(Ratings, userIdx)
+        for otherIdx, user2 in enumerate(Ratings.userIds):
+            if user1 != user2:
+                assert similarities[otherIdx] == pytest.approx(pearson_correlation(user1, user2))
+
+def test_exactly_correlated_users_tie_at_one(tmp_path, monkeypatch):
+    # user 2 rates like user 1 shifted, 3 twice as far apart, 4 half as far apart and shifted,
+    # 5 the opposite way (3 to 5 came out a rounding error off +-1 from the raw sums), 6 loosely alike
+    target = [0.5, 2.0, 2.5]
+    others = {2: [r + 1 for r in target], 3: [2 * r for r in target], 4: [r / 2 + 0.5 for r in target],
+              5: [5.5 - r for r in target], 6: [1.0, 2.5, 2.0]}
+    rows = [(1, movieId, rating) for movieId, rating in enumerate(target, 1)]
+    rows += [(userId, movieId, rating) for userId, ratings in others.items() for movieId, rating in enumerate(ratings, 1)]
+    matrix = RatingsMatrix.from_ratings(pd.DataFrame(rows, columns=['userId', 'movieId', 'rating']))
+    similarities = user_similarities(matrix, matrix.user_index(1))
+    assert [similarities[matrix.user_index(userId)] for userId in [2, 3, 4, 5]] == [1.0, 1.0, 1.0, -1.0]
+    assert user_similarities(matrix.to_dataframe().to_numpy(), matrix.user_index(1)).tolist() == similarities.tolist()
+
+    matrix.save(tmp_path / 'matrix.bin')
+    monkeypatch.setattr(reccomendation_algorithim, 'Registry', ModelRegistry(str(tmp_path / 'matrix.csv')))
+    # the reference order: pearson_correlation, without its rounding noise, ties in user order
+    reference = sorted(others, key=lambda userId: -round(float(pearson_correlation(1, userId)), 12))
+    assert [userId for userId, _ in find_nearest_neighbor(1, 5)] == reference
+
+def test_similarity_matrix_is_symmetric():
+    matrix = similarity_matrix(Ratings)
+    assert matrix.shape == (len(Ratings.userIds), len(Ratings.userIds))
+    assert np.allclose(matrix, matrix.T)
+
+def test_sparse_and_dense_similarity_agree():
+    dense = Ratings.to_dataframe().to_numpy()
+    assert np.allclose(similarity_matrix(Ratings), similarity_matrix(dense))
+
+def test_sparse_matrix_keeps_zero_ratings():
+    # user 7 rated movie 47 exactly at their mean, stored as an explicit 0.0
+    ratings = user_ratings(7)
+    assert list(ratings.index) == [47]
+    assert ratings[47] == 0.0
+
+def test_binary_artifact_round_trip(tmp_path):
+    ratings = pd.read_csv('testratings.csv')
+    matrix = RatingsMatrix.from_ratings(ratings)
+    path = tmp_path / 'matrix.bin'
+    matrix.save(path)
+    loaded = RatingsMatrix.load(path)
+    # memory-mapped arrays are read-only views of the file
+    assert not loaded.csr.data.flags.writeable
+    assert list(loaded.userIds) == list(matrix.userIds)
+    assert list(loaded.movieIds) == list(matrix.movieIds)
+    assert np.array_equal(loaded.userMeans, matrix.userMeans)
+    assert (loaded.csr != matrix.csr).nnz == 0
+    assert np.allclose(similarity_matrix(loaded), similarity_matrix(matrix))
+
+def test_streaming_preprocess_matches_in_memory(tmp_path):
+    streamed = preprocess_streaming('testratings.csv', tmp_path / 'matrix.csv', chunksize=4)
+    matrix = RatingsMatrix.from_ratings(pd.read_csv('testratings.csv'))
+    assert (tmp_path / 'matrix.bin').exists()
+    assert list(streamed.userIds) == list(matrix.userIds)
+    assert np.allclose(streamed.userMeans, matrix.userMeans)
+    assert abs(streamed.csr - matrix.csr).max() < 1e-12
+
+def test_incremental_update_matches_rebuild():
+    ratings = pd.read_csv('testratings.csv')
+    matrix = RatingsMatrix.from_ratings(ratings)
+    cache = SimilarityCache(matrix)
+    for userIdx in range(matrix.shape[0]):
+        cache.get(userIdx)
+
+    # change an existing rating, add one for an existing user, and rate as a new user
+    updates = [(1, 2, 1.0), (3, 11, 5.0), (100, 11, 4.0), (100, 12, 2.0), (100, 99, 3.0)]
+    for userId, movieId, rating in updates:
+        cache.refresh_user(matrix.set_rating(userId, movieId, rating))
+
+    ratings.loc[(ratings.userId == 1) & (ratings.movieId == 2), 'rating'] = 1.0
+    added = pd.DataFrame([u for u in updates[1:]], columns=['userId', 'movieId', 'rating'])
+    rebuilt = RatingsMatrix.from_ratings(pd.concat([ratings, added]))
+
+    assert list(matrix.userIds) == list(rebuilt.userIds)
+    assert list(matrix.movieIds) == list(rebuilt.movieIds)
+    assert np.allclose(matrix.userMeans, rebuilt.userMeans)
+    assert np.allclose(matrix.to_dataframe().to_numpy(), rebuilt.to_dataframe().to_numpy(), equal_nan=True)
+    expected = similarity_matrix(rebuilt)
+    for userIdx in range(matrix.shape[0]):
+        assert np.allclose(cache.get(userIdx), expected[userIdx])
+
+def test_refresh_user_leaves_rows_readers_hold():
+    matrix = RatingsMatrix.from_ratings(pd.read_csv('testratings.csv'))
+    cache = SimilarityCache(matrix)
+    held = cache.get(0)
+    before = held.copy()
+    cache.refresh_user(matrix.set_rating(matrix.userIds[1], 2, 1.0))
+    assert np.array_equal(held, before)
+    assert cache.get(0)[1] == user_similarities(matrix.snapshot(), 0)[1]
+
+def test_similarity_cache_sized_in_bytes():
+    matrix = RatingsMatrix.from_ratings(pd.read_csv('testratings.csv'))
+    cache = SimilarityCache(matrix, maxBytes=3 * 8 * matrix.shape[0])
+    for userIdx in range(matrix.shape[0]):
+        cache.get(userIdx)
+    assert list(cache._rows) == [matrix.shape[0] - 3, matrix.shape[0] - 2, matrix.shape[0] - 1]
+
+def test_replacing_a_users_ratings_matches_rebuild():
+    ratings = pd.read_csv('testratings.csv')
+    matrix = RatingsMatrix.from_ratings(ratings)
+    matrix.set_ratings(1, [(3, 5.0), (11, 1.0)], replace=True)
+    replaced = pd.DataFrame([(1, 3, 5.0), (1, 11, 1.0)], columns=['userId', 'movieId', 'rating'])
+    rebuilt = RatingsMatrix.from_ratings(pd.concat([ratings[ratings.userId != 1], replaced]))
+    assert np.allclose(matrix.userMeans, rebuilt.userMeans)
+    assert np.allclose(matrix.to_dataframe().to_numpy(), rebuilt.to_dataframe().to_numpy(), equal_nan=True)
+
+def test_seeded_movielens_users_keep_their_matrix_row():
+    assert reccomendation_algorithim.movielens_user_id("movielens3@moviemate.local") == 3
+    assert reccomendation_algorithim.movielens_user_id("someone@example.com") is None
+    assert reccomendation_algorithim.recommender_user_id("movielens3@moviemate.local", create=True) == 3
+    # a MovieLens id the matrix doesn't have gets a new row like any other app user
+    assert not Ratings.has_user(reccomendation_algorithim.recommender_user_id("movielens12345@moviemate.local", create=True))
+
 def test_find_nearest_neighbor():
     # Test with a valid user ID
     neighbors = find_nearest_neighbor(1, 5)
@@ -40,6 +172,31 @@ def test_find_nearest_neighbor():
     assert len(neighbors) <= 5
     # Optionally, check the type of elements in neighbors, etc.
 
+def test_neighbor_index_matches_live_search(tmp_path):
+    index = NeighborIndex.build(Ratings, k=5)
+    index.save(tmp_path / 'neighbors.npz')
+    index = NeighborIndex.load(tmp_path / 'neighbors.npz')
+    for userId in Ratings.userIds:
+        for numNeighbors in [0, 1, 5]:
+            ids, similarities = index.neighbors(userId, numNeighbors)
+            live = find_nearest_neighbor(userId, numNeighbors)
+            assert list(ids) == [neighbor_id for neighbor_id, _ in live]
+            assert np.allclose(similarities, [similarity for _, similarity in live])
+
+def test_parallel_neighbor_index_matches_sequential():
+    sequential = NeighborIndex.build(Ratings, k=5)
+    parallel = NeighborIndex.build(Ratings, k=5, workers=2)
+    assert np.array_equal(parallel.neighborIds, sequential.neighborIds)
+    assert np.array_equal(parallel.similarities, sequential.similarities)
+
+def test_rebuild_neighbor_index_swaps_index():
+    index = reccomendation_algorithim.rebuild_neighbor_index()
+    assert reccomendation_algorithim.Neighbors is index
+    assert find_nearest_neighbor(1, 5) == list(zip(*index.neighbors(1, 5)))
+
+def test_neighbor_rebuilds_disabled_with_zero_interval():
+    assert reccomendation_algorithim.start_neighbor_rebuilds(0) is None
+
 def test_find_nearest_neighbor_no_neighbors():
     neighbors = find_nearest_neighbor(8)
     assert len(neighbors) == 0 or all(neighbor[1] == 0 for neighbor in neighbors)
@@ -48,8 +205,12 @@ def test_neighbor_similarity_scores():
     neighbors = find_nearest_neighbor(3)
     assert all(-1 <= neighbor[1] <= 1 for neighbor in neighbors)
 
-def test_predict_rating():
-    rating = predict_rating(1, 2)  
+def test_predict_rating(tmp_path, monkeypatch):
+    # predictions are on the rating scale once the user's mean is added back; the centered
+    # test csv stores no means, so predict from a matrix built from the raw test ratings
+    RatingsMatrix.from_ratings(pd.read_csv('testratings.csv')).save(tmp_path / 'matrix.bin')
+    monkeypatch.setattr(reccomendation_algorithim, 'Registry', ModelRegistry(str(tmp_path / 'matrix.csv')))
+    rating = predict_rating(1, 2)
     assert isinstance(rating, float) or rating is None
     if rating is not None:
         assert 0.0 <= rating <= 5.0  
@@ -63,6 +224,45 @@ def test_predict_rating_different_neighbor_counts():
         predicted_rating = predict_rating(3, 4, numNeighbors=num_neighbors)
         assert isinstance(predicted_rating, (float, type(None)))
 
+def test_predict_ratings_matches_predict_rating():
+    movieIds = list(Ratings.movieIds)
+    for userId in Ratings.userIds:
+        predictions = predict_ratings(userId, movieIds)
+        assert len(predictions) == len(movieIds)
+        for movieId, prediction in zip(movieIds, predictions):
+            assert prediction == predict_rating(userId, movieId)
+
+def test_predict_ratings_invalid_user():
+    assert predict_ratings(9, [1, 2]) == [None, None]
+
+
+def test_top_k_matches_stable_sort():
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 5, size=200).astype(float)
+    scores[rng.integers(0, 200, size=10)] = -np.inf
+    for k in [0, 1, 7, 50, 199, 200, 300]:
+        expected = np.argsort(-scores, kind='stable')[:k]
+        assert list(top_k(scores, k)) == list(expected)
+
+def test_top_k_rows_matches_top_k_per_row():
+    rng = np.random.default_rng(1)
+    scores = rng.integers(0, 4, size=(20, 30)).astype(float)
+    scores[rng.random(scores.shape) < 0.3] = -np.inf
+    for k in [0, 1, 5, 30, 40]:
+        for row, top in zip(scores, top_k_rows(scores, k)):
+            expected = top_k(row, k)
+            assert list(top) == list(expected[np.isfinite(row[expected])])
+
+def test_recommendations_are_the_best_scored_movies():
+    for userId in Ratings.userIds:
+        unrated = [m for m in Ratings.movieIds if m not in set(user_ratings(userId).index)]
+        predictions = [(m, p) for m, p in zip(unrated, predict_ratings(userId, unrated)) if p is not None]
+        expected = sorted(predictions, key=lambda x: x[1], reverse=True)[:3]
+        ranked = rank_user_based(userId, 3)
+        assert [m for m, _ in ranked] == [m for m, _ in expected]
+        assert np.allclose([p for _, p in ranked], [p for _, p in expected])
+        assert reccomend_movies(userId, 3)[userId] == [m for m, _ in ranked]
+
 
 def test_recommend_movies_valid_user():
     
@@ -79,6 +279,107 @@ def test_recommend_movies_different_counts():
         recommendations = reccomend_movies(3, count)
         assert len(recommendations) <= count
     
+def test_item_similarities_are_adjusted_cosine():
+    dense = np.nan_to_num(Ratings.to_dataframe().to_numpy())
+    norms = np.linalg.norm(dense, axis=0)
+    index = ItemSimilarityIndex.build(Ratings, n=4, blockSize=5)
+    for movieIdx, (neighbors, similarities) in enumerate(zip(index.neighbors, index.similarities)):
+        assert movieIdx not in neighbors
+        for neighbor, similarity in zip(neighbors, similarities):
+            expected = dense[:, movieIdx] @ dense[:, neighbor] / (norms[movieIdx] * norms[neighbor]) \
+                if norms[movieIdx] * norms[neighbor] > 0 else 0.0
+            assert similarity == pytest.approx(expected, abs=1e-6)
+        assert list(similarities) == sorted(similarities, reverse=True)
+
+def test_item_based_recommendations_skip_rated_movies():
+    for userId in Ratings.userIds:
+        recommendations = reccomend_movies_item_based(userId, 5)[userId]
+        assert len(recommendations) <= 5
+        assert not set(recommendations) & set(user_ratings(userId).index)
+
+def test_matrix_factorization_fits_training_ratings(tmp_path):
+    matrix = RatingsMatrix.from_ratings(pd.read_csv('testratings.csv'))
+    model = MatrixFactorization.train(matrix, factors=8, iterations=20, regularization=0.01)
+    model.save(tmp_path / 'mf.npz')
+    model = MatrixFactorization.load(tmp_path / 'mf.npz')
+    assert model.itemFactors.dtype == np.float32
+    coo = matrix.csr.tocoo()
+    predictions = (model.userFactors[coo.row] * model.itemFactors[coo.col]).sum(axis=1)
+    assert np.sqrt(np.mean((predictions - coo.data) ** 2)) < 0.1
+    # folding a trained user back in lands close to their trained factors
+    cols, values = matrix.user_row(0)
+    assert np.allclose(model.fold_in(cols, values), model.userFactors[0], atol=0.05)
+
+def test_matrix_factorization_recommendations_skip_rated_movies():
+    for userId in Ratings.userIds:
+        recommendations = reccomend_movies_matrix_factorization(userId, 3)[userId]
+        assert len(recommendations) == 3
+        assert not set(recommendations) & set(user_ratings(userId).index)
+
+def test_holdout_split_keeps_a_training_rating_per_user():
+    ratings = pd.read_csv('testratings.csv')
+    train, test = holdout_split(ratings, 0.5)
+    assert len(train) + len(test) == len(ratings)
+    assert set(train['userId']) == set(ratings['userId'])
+
+def test_batch_recommendations_match_single_user(monkeypatch):
+    # every test user has fewer ratings than the content fallback threshold, score them all by CF
+    monkeypatch.setattr(reccomendation_algorithim, 'MIN_CF_RATINGS', 0)
+    # and with the same fallbacks as recommend(); an unknown user gets the popular movies
+    userIds = list(Ratings.userIds) + [12345]
+    for engine in ['user', 'item', 'mf']:
+        batch = list(recommend_batch(userIds, 3, engine, blockSize=2))
+        assert [userId for userId, _ in batch] == userIds
+        for userId, movieIds in batch[:-1]:
+            assert movieIds == reccomendation_algorithim.recommend(userId, 3, engine)
+        assert batch[-1] == (12345, reccomendation_algorithim.popular_movies(3))
+
+def test_batch_recommendations_see_new_ratings_without_compacting(tmp_path, monkeypatch):
+    RatingsMatrix.from_ratings(pd.read_csv('testratings.csv')).save(tmp_path / 'matrix.bin')
+    monkeypatch.setattr(reccomendation_algorithim, 'Registry', ModelRegistry(str(tmp_path / 'matrix.csv')))
+    monkeypatch.setattr(reccomendation_algorithim, 'MIN_CF_RATINGS', 0)
+    reccomendation_algorithim.update_user_rating(2, 1, 5.0)
+    ratings = reccomendation_algorithim.Registry.get().ratings
+    userIds = list(ratings.userIds)
+    for userId, movieIds in recommend_batch(userIds, 3, 'user', blockSize=2):
+        assert movieIds == reccomendation_algorithim.recommend(userId, 3, 'user')
+    # the rating is still an override of the base matrix
+    assert ratings._rowOverrides
+
+def test_few_ratings_are_recommended_by_content(monkeypatch):
+    monkeypatch.setattr(reccomendation_algorithim, 'MIN_CF_RATINGS', 5)
+    userId = 1
+    content = reccomendation_algorithim.reccomend_movies_content_based(userId, 3)[userId]
+    assert len(content) == 3
+    assert not set(content) & set(user_ratings(userId).index)
+    assert reccomendation_algorithim.recommend(userId, 3, 'user') == content
+    assert dict(recommend_batch([userId], 3, 'user'))[userId] == content
+    # from the threshold on, the engine's movies come first (the test users' own CF lists are
+    # empty, which now falls back to content, so stand in for the engine)
+    monkeypatch.setattr(reccomendation_algorithim, 'MIN_CF_RATINGS', 0)
+    monkeypatch.setitem(reccomendation_algorithim.RECOMMENDERS, 'user', lambda userId, n: {userId: [99]})
+    assert reccomendation_algorithim.recommend(userId, 3, 'user') == [99]
+
+def test_empty_cf_falls_back_to_content_then_popular(monkeypatch):
+    monkeypatch.setattr(reccomendation_algorithim, 'MIN_CF_RATINGS', 0)
+    monkeypatch.setitem(reccomendation_algorithim.RECOMMENDERS, 'user', lambda userId, n: {userId: []})
+    userId = 1
+    content = reccomendation_algorithim.reccomend_movies_content_based(userId, 3)[userId]
+    assert len(content) == 3
+    assert reccomendation_algorithim.recommend(userId, 3, 'user') == content
+    monkeypatch.setattr(reccomendation_algorithim, 'reccomend_movies_content_based', lambda userId, n: {userId: []})
+    popular = reccomendation_algorithim.recommend(userId, 3, 'user')
+    rated = set(user_ratings(userId).index)
+    assert len(popular) == 3 and not set(popular) & rated
+    assert popular == [movieId for movieId in reccomendation_algorithim.popular_movies(20) if movieId not in rated][:3]
+
+def test_similar_movies_share_genres():
+    similar = reccomendation_algorithim.similar_movies(1, 3)
+    # Toy Story: Adventure|Animation|Children|Comedy|Fantasy; Jumanji shares three and the year
+    assert [movieId for movieId, _ in similar][0] == 2
+    assert 1 not in [movieId for movieId, _ in similar]
+    assert [score for _, score in similar] == sorted([score for _, score in similar], reverse=True)
+    assert reccomendation_algorithim.similar_movies(99999) is None
 
 def test_extract_year():
     assert extractYear("Jumanji (1995)") == 1995
@@ -86,4 +387,23 @@ def test_extract_year():
 
 def test_cleanTitle():
     assert cleanTitle("Movie!@# Title (2021)") == "movie title"
-    assert cleanTitle("Another Title(2010)") == "another title"
\ No newline at end of file
+    assert cleanTitle("Another Title(2010)") == "another title"
+
+def test_preprocess_matches_apply_version(tmp_path):
+    movies = tmp_path / "movies.csv"
+    pd.DataFrame({"movieId": [1, 2, 3], "title": ["Toy Story (1995)", "Untitled!", "Heat, The (1995)"],
+                  "genres": ["Animation|Comedy", "(no genres listed)", "Action|Crime"]}).to_csv(movies, index=False)
+    encoded = preprocess(str(movies), str(tmp_path / "movies_encoded.csv"))
+    legacy = preprocess_apply(str(movies), str(tmp_path / "legacy.csv"))
+    assert encoded['title'].tolist() == legacy['title'].tolist() == ["toy story", "untitled", "heat the"]
+    assert encoded['year'].tolist()[::2] == [1995, 1995] and pd.isna(encoded['year'][1])
+    assert list(encoded.columns) == list(legacy.columns)
+    assert (encoded.iloc[:, 3:].to_numpy() == legacy.iloc[:, 3:].to_numpy()).all()
+    assert encoded.iloc[:, 3:].dtypes.eq(np.uint8).all()
+    # the binary copy holds the same catalog, and the genre bits load without the csv
+    loaded = load_encoded(str(tmp_path / "movies_encoded.npz"))
+    assert loaded.astype(str).equals(encoded.astype(str))
+    fromBinary = GenreBitsets.load(str(tmp_path / "movies_encoded.csv"))
+    fromCsv = GenreBitsets.from_frame(pd.read_csv(tmp_path / "movies_encoded.csv"))
+    assert (fromBinary.bits == fromCsv.bits).all()
+    assert np.array_equal(fromBinary.years, fromCsv.years, equal_nan=True)
@@ -0,0 +1,140 @@
+import asyncio
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from modelregistry import ModelRegistry
+import reccomendation_algorithim
+import recommendationworkers
+from recommendationworkers import RecommendationWorkers
+
+
+def test_duplicate_requests_share_one_job():
+    calls = []
+    release = threading.Event()
+
+    def job(userId, numReccomendations, engine, ratings):
+        calls.append(userId)
+        release.wait(5)
+        return [10, 20, 30][:numReccomendations], 0.01
+
+    async def run():
+        workers = RecommendationWorkers(2, 5.0, executor=ThreadPoolExecutor(2), job=job)
+        requests = [asyncio.ensure_future(workers.recommend(1, 2, "user")) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        release.set()
+        results = await asyncio.gather(*requests)
+        workers.shutdown()
+        return results, workers.stats()
+
+    results, stats = asyncio.run(run())
+    assert calls == [1]
+    assert results == [([10, 20], False)] * 5
+    assert stats["submitted"] == 1
+    assert stats["coalesced"] == 4
+    assert stats["completed"] == 1
+    assert stats["inFlight"] == 0
+
+def test_new_rating_starts_a_new_job():
+    seen = []
+
+    def job(userId, numReccomendations, engine, ratings):
+        seen.append(ratings)
+        return [1], 0.0
+
+    async def run():
+        workers = RecommendationWorkers(1, 5.0, executor=ThreadPoolExecutor(1), job=job)
+        workers._forwardRatings = True
+        await workers.recommend(7, 1, "user")
+        workers.record_ratings(7, [(42, 4.5), (3, 2.0)], replace=True)
+        await workers.recommend(7, 1, "user")
+        workers.record_ratings(7, [(42, 1.0)])
+        await workers.recommend(7, 1, "user")
+        workers.shutdown()
+
+    asyncio.run(run())
+    # every job gets the user's whole rating set
+    assert seen == [(), ((3, 2.0), (42, 4.5)), ((3, 2.0), (42, 1.0))]
+
+def test_recorded_users_are_capped():
+    workers = RecommendationWorkers(1, 5.0, executor=ThreadPoolExecutor(1), maxUsers=2)
+    workers._forwardRatings = True
+    for userId in [1, 2, 3]:
+        workers.record_ratings(userId, [(1, 4.0)], replace=True)
+    workers.record_ratings(2, [(2, 3.0)])
+    workers.record_ratings(4, [(1, 4.0)], replace=True)
+    workers.shutdown()
+    # the least recently rated users are dropped and have to be recorded in full again
+    assert list(workers._userRatings) == [2, 4]
+    assert workers._userRatings[2] == {1: 4.0, 2: 3.0}
+    assert not workers.has_ratings(3)
+
+def test_worker_job_loads_a_matrix_users_ratings_like_the_api(tmp_path, monkeypatch):
+    # the user already has a row in the matrix, which stores no means; the job replaces
+    # the row with the forwarded ratings, as the API process does when it loads the user
+    path = str(tmp_path / 'matrix.csv')
+    shutil.copy('testcentereduseritem_matrix.csv', path)
+    ratings = ((1, 4.0), (3, 4.0), (6, 4.0))
+    monkeypatch.setattr(reccomendation_algorithim, 'Registry', ModelRegistry(path))
+    reccomendation_algorithim.update_user_ratings(1, list(ratings), replace=True)
+    expected = reccomendation_algorithim.recommend(1, 7, 'user')
+
+    monkeypatch.setattr(reccomendation_algorithim, 'Registry', ModelRegistry(path))
+    monkeypatch.setattr(recommendationworkers, '_applied', OrderedDict())
+    movieIds, _ = recommendationworkers._recommend(1, 7, 'user', ratings)
+    assert movieIds == [int(movieId) for movieId in expected]
+    # the same set again isn't applied twice
+    assert recommendationworkers._recommend(1, 7, 'user', ratings)[0] == movieIds
+    assert reccomendation_algorithim.user_ratings(1).index.tolist() == [1, 3, 6]
+
+def test_deadline_falls_back_to_popular_movies():
+    def slow_job(userId, numReccomendations, engine, ratings):
+        time.sleep(0.3)
+        return [1, 2, 3], 0.3
+
+    async def run():
+        workers = RecommendationWorkers(1, 0.05, fallback=lambda n: [99, 98, 97][:n],
+                                        executor=ThreadPoolExecutor(1), job=slow_job)
+        result = await workers.recommend(1, 2, "user")
+        await asyncio.sleep(0.4)
+        workers.shutdown()
+        return result, workers.stats()
+
+    result, stats = asyncio.run(run())
+    assert result == ([99, 98], True)
+    assert stats["timeouts"] == 1
+    # the job still finishes and counts towards utilization
+    assert stats["completed"] == 1
+    assert stats["utilization"] > 0
+
+def test_failed_job_is_counted_and_raised():
+    def failing_job(userId, numReccomendations, engine, ratings):
+        raise KeyError(userId)
+
+    async def run():
+        workers = RecommendationWorkers(1, 5.0, executor=ThreadPoolExecutor(1), job=failing_job)
+        try:
+            await workers.recommend(1, 2, "user")
+        except KeyError:
+            pass
+        else:
+            raise AssertionError("expected the job's error")
+        workers.shutdown()
+        return workers.stats()
+
+    assert asyncio.run(run())["failed"] == 1
+
+def test_process_workers_score_with_forwarded_ratings():
+    # a user only the API process knows about is scored in a worker from the forwarded ratings
+    async def run():
+        workers = RecommendationWorkers(1, 60.0)
+        workers.record_ratings(1000, [(1, 5.0), (2, 3.0)], replace=True)
+        result = await workers.recommend(1000, 3, "user")
+        workers.shutdown()
+        return result
+
+    movieIds, fallback = asyncio.run(run())
+    assert not fallback
+    assert all(isinstance(movieId, int) for movieId in movieIds)
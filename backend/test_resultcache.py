@@ -0,0 +1,82 @@
+import pytest
+from resultcache import ResultCache, LocalBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_hit_and_miss():
+    cache = ResultCache(maxSize=4, ttlSeconds=60)
+    assert cache.get(1, "user", 7) is None
+    cache.put(1, "user", 7, value=[3, 2, 1])
+    assert cache.get(1, "user", 7) == [3, 2, 1]
+    assert cache.get(1, "item", 7) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+def test_cache_entries_expire():
+    clock = FakeClock()
+    cache = ResultCache(maxSize=4, ttlSeconds=60, clock=clock)
+    cache.put(1, "user", 7, value=[1])
+    clock.now = 59
+    assert cache.get(1, "user", 7) == [1]
+    clock.now = 61
+    assert cache.get(1, "user", 7) is None
+    assert cache.stats()["expirations"] == 1
+
+def test_cache_evicts_least_recently_used():
+    cache = ResultCache(maxSize=2, ttlSeconds=60)
+    cache.put(1, "user", 7, value=[1])
+    cache.put(2, "user", 7, value=[2])
+    cache.get(1, "user", 7)
+    cache.put(3, "user", 7, value=[3])
+    assert cache.get(2, "user", 7) is None
+    assert cache.get(1, "user", 7) == [1]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+def test_invalidate_user_drops_only_that_user():
+    cache = ResultCache(maxSize=8, ttlSeconds=60)
+    cache.put(1, "user", 7, value=[1])
+    cache.put(1, "item", 5, value=[2])
+    cache.put(2, "user", 7, value=[3])
+    cache.invalidate_user(1)
+    assert cache.get(1, "user", 7) is None
+    assert cache.get(1, "item", 5) is None
+    assert cache.get(2, "user", 7) == [3]
+
+def test_put_drops_results_computed_before_an_invalidation():
+    cache = ResultCache(maxSize=8, ttlSeconds=60)
+    generation = cache.generation(1)
+    assert cache.get(1, "user", 7) is None
+    # the user rates a movie while their recommendations are being computed
+    cache.invalidate_user(1)
+    cache.put(1, "user", 7, value=[1], generation=generation)
+    assert cache.get(1, "user", 7) is None
+    assert cache.stats()["staleWrites"] == 1
+    cache.put(1, "user", 7, value=[2], generation=cache.generation(1))
+    assert cache.get(1, "user", 7) == [2]
+
+def test_shared_backend_is_shared_and_invalidated_across_caches():
+    backend = LocalBackend()
+    worker1 = ResultCache(maxSize=8, ttlSeconds=60, backend=backend)
+    worker2 = ResultCache(maxSize=8, ttlSeconds=60, backend=backend)
+    worker1.put(1, "user", 7, value=[1, 2])
+    assert worker2.get(1, "user", 7) == [1, 2]
+    worker1.invalidate_user(1)
+    assert worker2.get(1, "user", 7) is None
+
+def test_put_drops_results_invalidated_by_another_cache():
+    backend = LocalBackend()
+    worker1 = ResultCache(maxSize=8, ttlSeconds=60, backend=backend)
+    worker2 = ResultCache(maxSize=8, ttlSeconds=60, backend=backend)
+    generation = worker1.generation(1)
+    worker2.invalidate_user(1)
+    worker1.put(1, "user", 7, value=[1], generation=generation)
+    assert worker1.get(1, "user", 7) is None
+    assert worker2.get(1, "user", 7) is None
@@ -0,0 +1,80 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from ratingsmatrix import RatingsMatrix
+from matrixfactorization import MatrixFactorization, matrix_factorization_path
+from neighborindex import top_neighbors, predict_from_neighbors
+from similarity import user_similarities
+
+
+def holdout_split(ratings, testFraction=0.2, seed=0):
+    # hold out a random testFraction of every user's ratings, always leaving
+    # the user at least one rating to train on
+    shuffled = ratings.sample(frac=1.0, random_state=seed)
+    rank = shuffled.groupby('userId').cumcount()
+    count = shuffled.groupby('userId')['movieId'].transform('size')
+    test = rank < np.minimum(np.floor(count * testFraction), count - 1)
+    return shuffled[~test], shuffled[test]
+
+
+def evaluate(ratings, factors, iterations, regularization, numNeighbors=5, testFraction=0.2):
+    # RMSE on held-out ratings of the factor model against the Pearson
+    # neighbor predictor; both fall back to the user's mean when they can't predict
+    train, test = holdout_split(ratings, testFraction)
+    matrix = RatingsMatrix.from_ratings(train)
+    model = MatrixFactorization.train(matrix, factors, iterations, regularization)
+
+    actual, meanPredictions, mfPredictions, pearsonPredictions = [], [], [], []
+    for userId, userTest in test.groupby('userId'):
+        userIdx = matrix.user_index(userId)
+        mean = matrix.userMeans[userIdx]
+        movieIdxs = matrix.movie_indexer(userTest['movieId'])
+        known = movieIdxs >= 0
+
+        mf = np.zeros(len(userTest))
+        mfIdxs = model.movie_indexer(userTest['movieId'])
+        mf[mfIdxs >= 0] = model.scores(model.user_vector(userId))[mfIdxs[mfIdxs >= 0]]
+
+        pearson = np.zeros(len(userTest))
+        neighborIdxs, similarities = top_neighbors(user_similarities(matrix, userIdx), userIdx, numNeighbors)
+        pearson[known] = np.nan_to_num(predict_from_neighbors(matrix, neighborIdxs, similarities, movieIdxs[known]))
+
+        actual.append(userTest['rating'].to_numpy())
+        meanPredictions.append(np.full(len(userTest), mean))
+        mfPredictions.append(mean + mf)
+        pearsonPredictions.append(mean + pearson)
+
+    actual = np.concatenate(actual)
+    def rmse(predictions):
+        return np.sqrt(np.mean((np.clip(np.concatenate(predictions), 0.5, 5.0) - actual) ** 2))
+    print(f"held-out ratings: {len(actual)}")
+    print(f"user mean RMSE:           {rmse(meanPredictions):.4f}")
+    print(f"pearson neighbors RMSE:   {rmse(pearsonPredictions):.4f}")
+    print(f"matrix factorization RMSE: {rmse(mfPredictions):.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train matrix factorization factors from ratings.csv")
+    parser.add_argument('--ratings', default='ratings.csv')
+    parser.add_argument('--matrix', default='centereduseritem_matrix.csv',
+                        help="matrix the factors are served next to")
+    parser.add_argument('--factors', type=int, default=32)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--regularization', type=float, default=0.1)
+    parser.add_argument('--evaluate', action='store_true',
+                        help="report held-out RMSE against the Pearson predictor instead of saving")
+    args = parser.parse_args()
+
+    ratings = pd.read_csv(args.ratings, usecols=['userId', 'movieId', 'rating'])
+    if args.evaluate:
+        evaluate(ratings, args.factors, args.iterations, args.regularization)
+        raise SystemExit
+
+    start = time.perf_counter()
+    model = MatrixFactorization.train(RatingsMatrix.from_ratings(ratings), args.factors, args.iterations,
+                                      args.regularization)
+    model.save(matrix_factorization_path(args.matrix))
+    print(f"trained {args.factors} factors for {len(model.userIds)} users and {len(model.movieIds)} movies "
+          f"in {time.perf_counter() - start:.2f}s")
@@ -5,7 +5,6 @@ import { useRouter } from 'next/navigation'
 import { useEffect, useState } from 'react'
 import { useSearchContext } from '@/context/searchContext'
 import MovieCard from '@/components/MovieCard'
-import { useSession } from 'next-auth/react'
 
 type Movie = {
     id: number;
@@ -18,7 +17,6 @@ export default function Home() {
     const router = useRouter()
     const searchParams = useSearchParams()
     const ctx = useSearchContext()
-    const { data: session } = useSession()  
 
     function getURLParams(searchParams: ReadonlyURLSearchParams): string {
         const newParams = new URLSearchParams(searchParams.toString());
@@ -39,7 +37,7 @@ export default function Home() {
     const fetchMovies = async () => {
       setLoading(true);
       try {
-        const response = await fetch(`http://127.0.0.1:8000/all-movies?user_email=${session?.user?.email}`, {
+        const response = await fetch(`http://127.0.0.1:8000/search?q=${encodeURIComponent(ctx.searchParam)}`, {
           method: 'GET',
           headers: {
               'Content-Type': 'application/json',
@@ -69,7 +67,7 @@ export default function Home() {
     };
 
     fetchMovies();
-  }, []);
+  }, [ctx.searchParam]);
 
     return (
         <>